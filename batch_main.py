@@ -0,0 +1,302 @@
+# batch_main.py
+
+"""
+Resumable batch verification.
+
+    python batch_main.py links.txt [--retry-failed]
+
+links.txt holds one Google Drive link per line. Progress is checkpointed
+per document and per stage in data/jobs.db; re-running the same command
+after a crash skips finished documents and resumes the others from their
+last finished stage. A stage exception fails that document only.
+
+Up to MAX_IN_FLIGHT documents move through the stages at once. To share
+the CPU with interactive checks under one scheduler, submit the batch to
+service.py instead of running this script next to it.
+"""
+
+import os
+import sys
+import base64
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import numpy as np
+
+from utils.image_loader import extract_file_id, pdf_to_images
+from utils.job_store import JobStore, STAGES
+from utils.results_store import ResultsWriter, ResultsStore
+from utils.scheduler import get_scheduler, BULK
+from stages.pdf_name_forensics import download_pdf_from_drive, analyze_pdf_name_region
+from stages.ocr import extract_text
+from stages.phash import process_phash_for_image
+from stages.submission_index import check_submission_reuse, holder_fingerprint
+from stages.cnn_patch_anomaly import run_page_and_patch_anomaly
+from stages.cnn_online_update import record_trusted_embedding
+from stages.aggregator import aggregate_verdict
+
+
+# Shared by all documents of a run; rows are flushed in batches
+results_writer = None
+
+# doc_refs of this run's documents that already have a results row
+recorded_results = set()
+
+# Documents in the stage pipeline at once; enough to keep every stage's
+# workers (utils.scheduler.STAGE_WORKERS) busy
+MAX_IN_FLIGHT = 16
+
+
+# ---------------- STAGES ----------------
+# Each stage reads the outputs so far and returns the keys it adds.
+# Checkpoints are committed in batches, so after a crash the last window
+# of stages runs again: every write outside the job store (issuer
+# baselines, submission index, normal pool) is keyed on "<doc_id>:p1"
+# and a replay finds the earlier write instead of adding a second one.
+
+def stage_fetched(doc_id, link, out):
+    pdf_path = download_pdf_from_drive(link)
+    return {
+        "pdf_path": pdf_path,
+        "pdf_forensics": analyze_pdf_name_region(pdf_path)
+    }
+
+
+def stage_rendered(doc_id, link, out):
+    # pdf_to_images deletes the PDF once the pages are written
+    image_paths = pdf_to_images(out["pdf_path"], doc_id)
+    if not image_paths:
+        raise ValueError("No images generated")
+    return {"image_path": os.path.abspath(image_paths[0])}
+
+
+def stage_ocr(doc_id, link, out):
+    ocr_out = extract_text(out["image_path"])
+    if not ocr_out["is_text_found"]:
+        raise ValueError("No text found in certificate")
+    return {"ocr": ocr_out}
+
+
+def stage_hashed(doc_id, link, out):
+    phash_result = process_phash_for_image(
+        image_path=out["image_path"],
+        ocr_text=out["ocr"]["raw_text"],
+        doc_ref=f"{doc_id}:p1"
+    )
+    duplicate_result = check_submission_reuse(
+        phash_hex=phash_result["phash"],
+        holder_hex=holder_fingerprint(out["image_path"], out["ocr"]),
+        ref=f"{doc_id}:p1",
+        name=out["pdf_forensics"].get("name_text", "")
+    )
+    return {"phash": phash_result, "duplicate": duplicate_result}
+
+
+def stage_scored(doc_id, link, out):
+    embedding, cnn_result = run_page_and_patch_anomaly(
+        out["image_path"], out["ocr"], out["phash"]["issuer_id"]
+    )
+    return {
+        "cnn": cnn_result,
+        "embedding": base64.b64encode(embedding.astype(np.float32).tobytes()).decode("ascii")
+    }
+
+
+def stage_aggregated(doc_id, link, out):
+    final_result = aggregate_verdict(
+        out["pdf_forensics"],
+        out["phash"],
+        out["cnn"],
+        out["duplicate"]
+    )
+    embedding = np.frombuffer(base64.b64decode(out["embedding"]), dtype=np.float32)
+    record_trusted_embedding(final_result, embedding, doc_ref=f"{doc_id}:p1")
+
+    if results_writer is not None and f"{doc_id}:p1" not in recorded_results:
+        append_result(results_writer, doc_id, {**out, "final": final_result})
+    return {"final": final_result}
+
+
+def append_result(writer, doc_id, out, ts=None):
+    writer.append(
+        out["pdf_forensics"],
+        out["phash"],
+        out["cnn"],
+        out["final"],
+        out["duplicate"],
+        doc_ref=f"{doc_id}:p1",
+        ts=ts
+    )
+
+
+# Scheduler queue each stage runs on (see utils.scheduler.STAGE_WORKERS)
+STAGE_QUEUES = {
+    "fetched": "fetch",
+    "rendered": "render",
+    "ocr": "ocr",
+    "hashed": "phash",
+    "scored": "cnn",
+    "aggregated": "aggregate",
+}
+
+
+STAGE_FUNCS = {
+    "fetched": stage_fetched,
+    "rendered": stage_rendered,
+    "ocr": stage_ocr,
+    "hashed": stage_hashed,
+    "scored": stage_scored,
+    "aggregated": stage_aggregated,
+}
+
+
+# ---------------- RESUME ----------------
+
+def resume_index(last_stage, out):
+    """
+    Index of the first stage still to run. Intermediate files live on
+    disk, so step back if the one we need is gone.
+    """
+    start = STAGES.index(last_stage) + 1 if last_stage else 0
+
+    needs_image = start > STAGES.index("rendered")
+    if needs_image and not os.path.exists(out.get("image_path", "")):
+        start = STAGES.index("rendered")
+
+    if start == STAGES.index("rendered") and not os.path.exists(out.get("pdf_path", "")):
+        start = STAGES.index("fetched")
+
+    return start
+
+
+class _Document:
+    __slots__ = ("doc_id", "link", "out", "last_stage", "index")
+
+    def __init__(self, doc_id, link, last_stage, out):
+        self.doc_id = doc_id
+        self.link = link
+        self.out = out
+        self.last_stage = last_stage
+        self.index = resume_index(last_stage, out)
+
+
+def _submit_stage(scheduler, doc):
+    stage = STAGES[doc.index]
+    return scheduler.submit(
+        STAGE_QUEUES[stage], STAGE_FUNCS[stage], doc.doc_id, doc.link, doc.out,
+        priority=BULK
+    )
+
+
+def run_documents(store, jobs, max_in_flight=MAX_IN_FLIGHT, on_done=None):
+    """
+    Runs up to max_in_flight documents at once, each stage as BULK work
+    on the shared scheduler: while one document is in OCR the next is
+    rendering, so every stage pool has work. Interactive checks in the
+    same process go first and admission control can hold the batch back.
+
+    Stage results come back to this thread, which does all checkpointing
+    (the JobStore connection belongs to it).
+    on_done(doc_id, ok) is called as each document finishes.
+    """
+    scheduler = get_scheduler()
+    on_done = on_done or (lambda doc_id, ok: None)
+    waiting = deque(jobs)
+    running = {}
+
+    def advance(doc):
+        if doc.index >= len(STAGES):
+            on_done(doc.doc_id, True)
+        else:
+            running[_submit_stage(scheduler, doc)] = doc
+
+    def admit():
+        while waiting and len(running) < max_in_flight:
+            doc_id, link = waiting.popleft()
+            advance(_Document(doc_id, link, *store.load(doc_id)))
+
+    admit()
+    while running:
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+            doc = running.pop(future)
+            stage = STAGES[doc.index]
+            try:
+                doc.out.update(future.result())
+            except Exception as e:
+                store.mark_failed(doc.doc_id, doc.last_stage, doc.out, f"{stage}: {e}")
+                on_done(doc.doc_id, False)
+                continue
+
+            store.checkpoint(doc.doc_id, stage, doc.out)
+            doc.last_stage = stage
+            doc.index += 1
+            advance(doc)
+        admit()
+
+
+def reconcile_results(store, writer, jobs):
+    """
+    Results rows are written in large parts (FLUSH_ROWS, or at the end of
+    a run), not with every checkpoint. After a crash, finished documents
+    may be missing their row: it is rebuilt from the stored stage outputs.
+    Returns the doc_refs of `jobs` that already have a row, so a replayed
+    aggregated stage does not add a second one.
+    """
+    recorded = ResultsStore(writer.root).doc_refs()
+
+    done = store.done_jobs()
+    refs = np.array([f"{doc_id}:p1".encode("utf-8") for doc_id, _ in done], dtype=recorded.dtype)
+    missing = np.flatnonzero(~np.isin(refs, recorded))
+    for i in missing:
+        doc_id, updated_at = done[i]
+        _, out = store.load(doc_id)
+        if "final" in out:
+            append_result(writer, doc_id, out, ts=updated_at)
+    if len(missing):
+        print(f"♻ Restored {len(missing)} missing results rows")
+
+    refs = np.array([f"{doc_id}:p1".encode("utf-8") for doc_id, _ in jobs], dtype=recorded.dtype)
+    return {ref.decode("utf-8") for ref in refs[np.isin(refs, recorded)]}
+
+
+def run_batch(links, store=None, retry_failed=False):
+    global results_writer, recorded_results
+
+    store = store or JobStore()
+    results_writer = results_writer or ResultsWriter()
+    store.add_jobs([(extract_file_id(link), link) for link in links])
+
+    jobs = store.unfinished_jobs(retry_failed)
+    recorded_results = reconcile_results(store, results_writer, jobs)
+    print(f"🚀 {len(jobs)} documents to process")
+
+    done = 0
+
+    def report(doc_id, ok):
+        nonlocal done
+        done += 1
+        print(f"{'✅' if ok else '❌'} [{done}/{len(jobs)}] {doc_id}")
+
+    try:
+        run_documents(store, jobs, on_done=report)
+    finally:
+        store.flush()
+        results_writer.flush()
+
+    return store.summary()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python batch_main.py <links.txt> [--retry-failed]")
+        sys.exit(1)
+
+    with open(sys.argv[1]) as f:
+        links = [line.strip() for line in f if line.strip()]
+
+    summary = run_batch(links, retry_failed="--retry-failed" in sys.argv)
+
+    print("\n📊 Batch summary")
+    for status, count in summary.items():
+        print(f"{status}: {count}")
@@ -1,78 +1,155 @@
 # main.py
 
 import os
-from utils.image_loader import process_drive_pdf
+import time
+from utils.image_loader import process_drive_pdf, extract_file_id
 from stages.ocr import extract_text
 from stages.phash import process_phash_for_image
+from stages.submission_index import check_submission_reuse, holder_fingerprint
 from stages.pdf_name_forensics import run_pdf_name_forensics
-from stages.cnn_infer_anomaly import run_cnn_anomaly
+from stages.cnn_patch_anomaly import run_page_and_patch_anomaly
+from stages.cnn_online_update import record_trusted_embedding
 from stages.aggregator import aggregate_verdict
+from utils.results_store import ResultsWriter
+from utils.scheduler import get_scheduler, INTERACTIVE
 
 
+# One deadline for the whole check, shared by all of its stages
+REQUEST_DEADLINE_S = 60.0
 
-def main():
-    print("🚀 EduVault verification started")
 
-    link = input("Enter Google Drive PDF link: ").strip()
+def run_stage(stage, fn, *args, deadline=None, **kwargs):
+    """Single checks run as INTERACTIVE work on the shared stage scheduler."""
+    return get_scheduler().run(
+        stage, fn, *args, priority=INTERACTIVE, deadline=deadline, **kwargs
+    )
 
-    # 🔍 STEP 0: PDF Name Forensics (non-blocking)
-    pdf_forensics = run_pdf_name_forensics(link)
 
-    print("\n🧾 PDF Name Forensics Result:")
-    for k, v in pdf_forensics.items():
+def _print_result(title, result):
+    print(f"\n{title}")
+    for k, v in result.items():
         print(f"{k}: {v}")
 
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+def verify_link(link, deadline_s=REQUEST_DEADLINE_S, verbose=True):
+    """
+    Runs the full check for one Drive PDF link and returns
+    {"pdf_forensics", "phash", "duplicate", "cnn", "final"}, or
+    {"error": ...} when the PDF yields no usable page.
+    Raises DeadlineExceeded when the check overruns deadline_s.
+    """
+    show = _print_result if verbose else _quiet
+    say = print if verbose else _quiet
+
+    deadline = time.monotonic() + deadline_s
+    doc_ref = f"{extract_file_id(link)}:p1"
+
+    # 🔍 STEP 0: PDF Name Forensics (non-blocking)
+    pdf_forensics = run_stage("fetch", run_pdf_name_forensics, link, deadline=deadline)
+    show("🧾 PDF Name Forensics Result:", pdf_forensics)
+
     # Step 1: Convert PDF → images
-    image_paths = process_drive_pdf(link)
+    image_paths = run_stage("render", process_drive_pdf, link, deadline=deadline)
 
     if not image_paths:
-        print("❌ No images generated")
-        return
+        return {"error": "No images generated"}
 
     image_path = os.path.abspath(image_paths[0])
-    print(f"\n📄 Processing image: {image_path}")
+    say(f"\n📄 Processing image: {image_path}")
 
     # Step 2: OCR
-    ocr_out = extract_text(image_path)
+    ocr_out = run_stage("ocr", extract_text, image_path, deadline=deadline)
 
     if not ocr_out["is_text_found"]:
-        print("❌ No text found in certificate")
-        return
+        return {"error": "No text found in certificate"}
 
-    print("\n🧠 OCR Extraction Result:")
-    print(ocr_out["raw_text"][:1000])
+    say("\n🧠 OCR Extraction Result:")
+    say(ocr_out["raw_text"][:1000])
     if len(ocr_out["raw_text"]) > 1000:
-        print("\n... [truncated]")
+        say("\n... [truncated]")
 
     # Step 3: pHash
-    phash_result = process_phash_for_image(
+    phash_result = run_stage(
+        "phash",
+        process_phash_for_image,
         image_path=image_path,
-        ocr_text=ocr_out["raw_text"]
+        ocr_text=ocr_out["raw_text"],
+        doc_ref=doc_ref,
+        deadline=deadline
     )
-
-    print("\n🔎 pHash Verification Result:")
-    for k, v in phash_result.items():
-        print(f"{k}: {v}")
-
-    # Step 4: CNN anomaly detection
-    cnn_result = run_cnn_anomaly(image_path)
-
-    print("\n🧠 CNN Anomaly Detection Result:")
-    for k, v in cnn_result.items():
-        print(f"{k}: {v}")
+    show("🔎 pHash Verification Result:", phash_result)
+
+    # Step 3b: Near-duplicate submission check
+    duplicate_result = check_submission_reuse(
+        phash_hex=phash_result["phash"],
+        holder_hex=holder_fingerprint(image_path, ocr_out),
+        ref=doc_ref,
+        name=pdf_forensics.get("name_text", "")
+    )
+    show("♻ Submission Reuse Check:", duplicate_result)
+
+    # Step 4: CNN anomaly detection, page + patches (name / date regions,
+    # page grid) in one forward pass
+    embedding, cnn_result = run_stage(
+        "cnn",
+        run_page_and_patch_anomaly,
+        image_path,
+        ocr_out,
+        phash_result["issuer_id"],
+        deadline=deadline
+    )
+    show("🧠 CNN Anomaly Detection Result:", cnn_result)
 
     # ---------------- FINAL AGGREGATION ----------------
-    final_result = aggregate_verdict(
+    final_result = run_stage(
+        "aggregate",
+        aggregate_verdict,
         pdf_forensics,
         phash_result,
-        cnn_result
+        cnn_result,
+        duplicate_result,
+        deadline=deadline
     )
-    
-    print("\n🧮 FINAL AGGREGATED VERDICT")
-    for k, v in final_result.items():
-        print(f"{k}: {v}")
+    show("🧮 FINAL AGGREGATED VERDICT", final_result)
+
+    # Keep the result for analytics
+    with ResultsWriter() as writer:
+        writer.append(
+            pdf_forensics,
+            phash_result,
+            cnn_result,
+            final_result,
+            duplicate_result,
+            doc_ref=doc_ref
+        )
+
+    # Trusted certificates feed the online anomaly-model updates
+    if record_trusted_embedding(final_result, embedding, doc_ref=doc_ref):
+        say("\n📥 Embedding added to normal pool")
+
+    return {
+        "pdf_forensics": pdf_forensics,
+        "phash": phash_result,
+        "duplicate": duplicate_result,
+        "cnn": cnn_result,
+        "final": final_result
+    }
 
 
+def main():
+    print("🚀 EduVault verification started")
+
+    link = input("Enter Google Drive PDF link: ").strip()
+
+    result = verify_link(link)
+    if "error" in result:
+        print(f"❌ {result['error']}")
+        return
+
     print("\n✅ Pipeline completed")
 
 
@@ -0,0 +1,76 @@
+# scripts/bench_cnn_batch.py
+
+"""
+Throughput of run_cnn_anomaly_batch vs batch size.
+
+    python -m scripts.bench_cnn_batch [image_dir] [num_images]
+
+Without image_dir, synthetic 300-DPI A4 pages are generated in memory.
+"""
+
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from stages.cnn_infer_anomaly import (
+    run_cnn_anomaly,
+    run_cnn_anomaly_batch,
+    get_feature_extractor,
+    get_anomaly_model
+)
+
+BATCH_SIZES = [1, 4, 8, 16, 32, 64]
+DEFAULT_NUM_IMAGES = 64
+
+
+def synthetic_pages(n, size=(2480, 3508)):
+    rng = np.random.default_rng(0)
+    pages = []
+    for _ in range(n):
+        arr = np.full((size[1], size[0], 3), 255, dtype=np.uint8)
+        for _ in range(20):
+            x, y = rng.integers(0, size[0] - 400), rng.integers(0, size[1] - 200)
+            arr[y:y + 200, x:x + 400] = rng.integers(0, 255, 3)
+        buf = io.BytesIO()
+        Image.fromarray(arr).save(buf, "PNG")
+        pages.append(buf.getvalue())
+    return pages
+
+
+def load_dir(image_dir, n):
+    paths = sorted(
+        os.path.join(image_dir, f) for f in os.listdir(image_dir)
+        if f.lower().endswith((".png", ".jpg", ".jpeg"))
+    )
+    return (paths * (n // max(len(paths), 1) + 1))[:n]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NUM_IMAGES
+    sources = load_dir(sys.argv[1], n) if len(sys.argv) > 1 else synthetic_pages(n)
+
+    # Warm up model loading so it is not counted
+    get_feature_extractor()
+    get_anomaly_model()
+    run_cnn_anomaly_batch(sources[:2])
+
+    print(f"🧪 {len(sources)} images, torch threads = {torch.get_num_threads()}")
+
+    if isinstance(sources[0], str):
+        t = timed(lambda: [run_cnn_anomaly(p) for p in sources])
+        print(f"run_cnn_anomaly loop : {len(sources) / t:7.1f} img/s")
+
+    for bs in BATCH_SIZES:
+        t = timed(lambda: run_cnn_anomaly_batch(sources, batch_size=bs))
+        print(f"batch_size={bs:<3}        : {len(sources) / t:7.1f} img/s")
@@ -0,0 +1,67 @@
+# scripts/bench_knn_vs_iforest.py
+
+"""
+Latency and memory: IsolationForest vs the k-NN template index.
+
+    python -m scripts.bench_knn_vs_iforest [num_templates] [num_issuers]
+
+Uses synthetic 512-D ReLU-like embeddings, so no CNN is needed.
+"""
+
+import sys
+import time
+import pickle
+
+import numpy as np
+
+from stages.cnn_train_anomaly import train_anomaly_model
+from stages.cnn_knn_anomaly import KnnIndex
+
+DEFAULT_TEMPLATES = 2000
+DEFAULT_ISSUERS = 10
+QUERY_BATCH = 64
+REPEATS = 50
+
+
+def synthetic_embeddings(n, issuers, rng):
+    centers = np.abs(rng.normal(size=(issuers, 512))).astype(np.float32)
+    labels = rng.integers(0, issuers, n)
+    noise = np.abs(rng.normal(scale=0.3, size=(n, 512))).astype(np.float32)
+    return centers[labels] + noise, np.array([f"issuer{i}" for i in labels])
+
+
+def per_call_ms(fn, repeats=REPEATS):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TEMPLATES
+    n_issuers = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ISSUERS
+    rng = np.random.default_rng(0)
+
+    templates, issuers = synthetic_embeddings(n, n_issuers, rng)
+    queries, query_issuers = synthetic_embeddings(QUERY_BATCH, n_issuers, rng)
+
+    forest = train_anomaly_model(templates)
+    indexes = {
+        dtype: KnnIndex.build(templates, issuers, [f"t{i}" for i in range(n)], dtype)
+        for dtype in ("int8", "float16")
+    }
+
+    print(f"🧪 {n} templates, {n_issuers} issuers, query batch = {QUERY_BATCH}\n")
+    print(f"{'detector':<18}{'1 query (ms)':>14}{'batch (ms)':>12}{'memory (KB)':>14}")
+
+    single = per_call_ms(lambda: forest.decision_function(queries[:1]))
+    batch = per_call_ms(lambda: forest.decision_function(queries))
+    memory = len(pickle.dumps(forest)) / 1024
+    print(f"{'IsolationForest':<18}{single:>14.3f}{batch:>12.3f}{memory:>14.1f}")
+
+    for dtype, index in indexes.items():
+        single = per_call_ms(lambda: index.search(queries[:1], query_issuers[:1]))
+        batch = per_call_ms(lambda: index.search(queries, query_issuers))
+        memory = index.nbytes / 1024
+        print(f"{'k-NN ' + dtype:<18}{single:>14.3f}{batch:>12.3f}{memory:>14.1f}")
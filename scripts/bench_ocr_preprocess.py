@@ -0,0 +1,93 @@
+# scripts/bench_ocr_preprocess.py
+
+"""
+OCR preprocessing latency and peak memory: full-page vs tiled.
+
+    python -m scripts.bench_ocr_preprocess [certificate.png ...]
+
+Without images, a synthetic 300-DPI A4 page (2480x3508) is generated.
+Each variant runs in its own process so peak RSS is not shared.
+"""
+
+import os
+import sys
+import time
+import resource
+import statistics
+import subprocess
+
+import cv2
+import numpy as np
+
+REPEATS = 10
+SYNTHETIC_PATH = "bench_page.png"
+
+# Name / date band of a typical certificate, as page fractions
+SAMPLE_REGION = (0.1, 0.35, 0.9, 0.6)
+
+VARIANTS = ["full", "tiled", "tiled_regions"]
+
+
+def make_synthetic_page(path, size=(2480, 3508)):
+    rng = np.random.default_rng(0)
+    img = np.full((size[1], size[0], 3), 255, dtype=np.uint8)
+    for _ in range(300):
+        x, y = int(rng.integers(0, size[0] - 100)), int(rng.integers(0, size[1]))
+        color = tuple(int(c) for c in rng.integers(0, 200, 3))
+        cv2.putText(img, "Certificate", (x, y), cv2.FONT_HERSHEY_SIMPLEX, 2, color, 3)
+    cv2.imwrite(path, img)
+    return path
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_variant(variant, image_path):
+    """Child process: time one preprocessing variant."""
+    from stages.ocr import preprocess_image, preprocess_image_full
+
+    h, w = cv2.imread(image_path, cv2.IMREAD_UNCHANGED).shape[:2]
+    rx0, ry0, rx1, ry1 = SAMPLE_REGION
+    regions = [(int(rx0 * w), int(ry0 * h), int(rx1 * w), int(ry1 * h))]
+
+    fn = {
+        "full": lambda: preprocess_image_full(image_path),
+        "tiled": lambda: preprocess_image(image_path),
+        "tiled_regions": lambda: preprocess_image(image_path, regions),
+    }[variant]
+
+    base_rss = peak_rss_mb()
+    fn()
+    peak = peak_rss_mb() - base_rss
+
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    print(f"{statistics.median(times):.1f} {peak:.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--variant":
+        run_variant(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    images = sys.argv[1:] or [make_synthetic_page(SYNTHETIC_PATH)]
+
+    for image_path in images:
+        print(f"\n🧪 {image_path}")
+        print(f"{'variant':<16}{'median (ms)':>14}{'peak +RSS (MB)':>16}")
+
+        for variant in VARIANTS:
+            out = subprocess.run(
+                [sys.executable, "-m", "scripts.bench_ocr_preprocess", "--variant", variant, image_path],
+                capture_output=True, text=True, check=True
+            ).stdout.split()
+            print(f"{variant:<16}{float(out[-2]):>14.1f}{float(out[-1]):>16.1f}")
+
+    if not sys.argv[1:] and os.path.exists(SYNTHETIC_PATH):
+        os.remove(SYNTHETIC_PATH)
@@ -0,0 +1,201 @@
+# scripts/calibrate_aggregator.py
+
+"""
+Grid-search aggregator weights, boost and verdict bands against a
+labelled result set.
+
+    python -m scripts.calibrate_aggregator labelled.jsonl [params_out.json]
+
+Each JSONL line is one verified document, either flat:
+    {"forensic_score": 1, "hamming_distance": 6, "cnn_anomaly_score": 0.07,
+     "label": "genuine"}
+or with the stage result dicts as stored by batch_main:
+    {"pdf_forensics": {...}, "phash": {...}, "cnn": {...},
+     "duplicate": {...}, "label": "forged"}
+
+label: "genuine" / "forged" (or 1 / 0).
+
+Objective: balanced accuracy of "trust_score >= mostly_trusted" as the
+accept decision. The other two bands keep their default spacing around
+the calibrated cut. All trust scores for a block of weight combinations
+are computed in one matrix product, and every threshold is scored at
+once from cumulative histograms.
+"""
+
+import sys
+import json
+import itertools
+
+import numpy as np
+
+from stages.aggregator import (
+    DEFAULT_PARAMS,
+    risk_components,
+    boost_eligibility,
+    aggregate_verdict_batch
+)
+
+# ---------------- CONFIG ----------------
+
+WEIGHT_STEP = 0.05
+BOOST_CHOICES = [0, 6, 12, 18]
+
+# Trust scores are binned at 0.1 resolution for threshold search
+BINS = 1001
+
+# Weight combinations evaluated per matrix product
+COMBO_BLOCK = 16
+
+
+# ---------------- LOADING ----------------
+
+def is_genuine(label):
+    if isinstance(label, str):
+        return label.strip().lower() in ("genuine", "original", "real", "1", "true")
+    return bool(label)
+
+
+def load_labelled(path):
+    """
+    Returns dict of column arrays: forensic, hamming, cnn, boost, reused, genuine.
+    """
+    cols = {k: [] for k in ("forensic", "hamming", "cnn", "boost", "reused", "genuine")}
+
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+
+            pdf = row.get("pdf_forensics", row)
+            phash = row.get("phash", row)
+            cnn = row.get("cnn", row)
+            dup = row.get("duplicate", row)
+
+            cols["forensic"].append(pdf.get("forensic_score", 0))
+            cols["hamming"].append(phash.get("hamming_distance", 20))
+            cols["cnn"].append(cnn.get("cnn_anomaly_score", 0.0))
+            cols["reused"].append(dup.get("duplicate_verdict") == "REUSED_UNDER_DIFFERENT_NAME")
+            cols["genuine"].append(is_genuine(row["label"]))
+
+            if "verdict" in pdf and "phash_verdict" in phash and "cnn_anomaly_verdict" in cnn:
+                cols["boost"].append(
+                    pdf["verdict"] == "LIKELY_ORIGINAL"
+                    and phash["phash_verdict"] == "VISUALLY_MATCHING"
+                    and cnn["cnn_anomaly_verdict"] == "NORMAL"
+                )
+            else:
+                cols["boost"].append(None)
+
+    data = {k: np.asarray(v) for k, v in cols.items() if k != "boost"}
+
+    # Rows without stage verdicts fall back to the score-derived rule
+    derived = boost_eligibility(data["forensic"], data["hamming"], data["cnn"])
+    data["boost"] = np.array([
+        d if b is None else b for b, d in zip(cols["boost"], derived)
+    ], dtype=bool)
+
+    return data
+
+
+# ---------------- SEARCH ----------------
+
+def weight_grid(step=WEIGHT_STEP):
+    """
+    All (pdf, phash, cnn) weights on the simplex, in `step` increments.
+    """
+    n = int(round(1 / step))
+    combos = [
+        (i * step, j * step, (n - i - j) * step)
+        for i, j in itertools.product(range(n + 1), repeat=2)
+        if i + j <= n
+    ]
+    return np.array(combos)
+
+
+def best_threshold(trust, genuine):
+    """
+    trust: (m, n) scores for m parameter sets.
+    Returns (best balanced accuracy, best threshold) per row, checking
+    every 0.1-point threshold via cumulative histograms.
+    """
+    bins = np.clip(np.round(trust * 10).astype(np.int64), 0, BINS - 1)
+    m = trust.shape[0]
+    offsets = (np.arange(m) * BINS)[:, None]
+
+    g_hist = np.bincount((bins + offsets)[:, genuine].ravel(), minlength=m * BINS).reshape(m, BINS)
+    f_hist = np.bincount((bins + offsets)[:, ~genuine].ravel(), minlength=m * BINS).reshape(m, BINS)
+
+    # accept = trust >= t → genuine accepted = suffix sum, forged rejected = prefix sum
+    tpr = g_hist[:, ::-1].cumsum(axis=1)[:, ::-1] / max(genuine.sum(), 1)
+    tnr = np.concatenate([np.zeros((m, 1)), f_hist.cumsum(axis=1)[:, :-1]], axis=1) / max((~genuine).sum(), 1)
+
+    bal_acc = (tpr + tnr) / 2
+    idx = bal_acc.argmax(axis=1)
+    return bal_acc[np.arange(m), idx], idx / 10
+
+
+def calibrate(data, weights=None, boosts=BOOST_CHOICES):
+    weights = weight_grid() if weights is None else weights
+    risks = np.stack(risk_components(data["forensic"], data["hamming"], data["cnn"]))
+    genuine = data["genuine"].astype(bool)
+    reused = data["reused"].astype(bool)
+    boost_rows = data["boost"] & ~reused
+
+    best = (-1.0, None)
+    for start in range(0, len(weights), COMBO_BLOCK):
+        w = weights[start:start + COMBO_BLOCK]
+        base = np.round((1 - w @ risks) * 100, 1)
+
+        for boost in boosts:
+            trust = np.where(boost_rows, np.minimum(base + boost, DEFAULT_PARAMS["boost_cap"]), base)
+            trust = np.where(reused, np.maximum(trust - DEFAULT_PARAMS["reuse_penalty"], 0.0), trust)
+
+            acc, thr = best_threshold(trust, genuine)
+            i = acc.argmax()
+            if acc[i] > best[0]:
+                best = (float(acc[i]), (w[i], boost, float(thr[i])))
+
+    score, (w, boost, cut) = best
+    spread_hi = DEFAULT_PARAMS["highly_trusted"] - DEFAULT_PARAMS["mostly_trusted"]
+    spread_lo = DEFAULT_PARAMS["mostly_trusted"] - DEFAULT_PARAMS["needs_review"]
+
+    params = {
+        "pdf_weight": round(float(w[0]), 4),
+        "phash_weight": round(float(w[1]), 4),
+        "cnn_weight": round(float(w[2]), 4),
+        "boost": boost,
+        "mostly_trusted": cut,
+        "highly_trusted": min(cut + spread_hi, 100.0),
+        "needs_review": max(cut - spread_lo, 0.0),
+    }
+    return params, score
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m scripts.calibrate_aggregator <labelled.jsonl> [params_out.json]")
+        sys.exit(1)
+
+    data = load_labelled(sys.argv[1])
+    print(f"📊 {len(data['genuine'])} labelled documents ({int(data['genuine'].sum())} genuine)")
+
+    trust, _ = aggregate_verdict_batch(
+        data["forensic"], data["hamming"], data["cnn"],
+        boost_mask=data["boost"], reused_mask=data["reused"]
+    )
+    genuine = data["genuine"].astype(bool)
+    accepted = trust >= DEFAULT_PARAMS["mostly_trusted"]
+    default_score = (accepted[genuine].mean() + (~accepted[~genuine]).mean()) / 2
+
+    params, score = calibrate(data)
+
+    print(f"📏 Default params balanced accuracy: {default_score:.4f}")
+    print(f"✅ Calibrated balanced accuracy:     {score:.4f}")
+    for k, v in params.items():
+        print(f"{k}: {v}")
+
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "w") as f:
+            json.dump(params, f, indent=2)
+        print(f"💾 Params written to {sys.argv[2]}")
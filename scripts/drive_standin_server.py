@@ -0,0 +1,115 @@
+# scripts/drive_standin_server.py
+
+"""
+Local stand-in for the Drive download endpoint.
+
+Serves <root>/<file_id>.pdf at /uc?export=download&id=<file_id> with
+Range / If-Range support (ETag from size + mtime), and can inject
+latency and failures:
+
+    python -m scripts.drive_standin_server <root> [--port 8765]
+        [--latency 0.2] [--fail-rate 0.2] [--drop-rate 0.2]
+
+--fail-rate   fraction of requests answered with 503 + Retry-After
+--drop-rate   fraction of responses cut off halfway through the body
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    root = "."
+    latency = 0.0
+    fail_rate = 0.0
+    drop_rate = 0.0
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+
+        file_id = parse_qs(urlparse(self.path).query).get("id", [""])[0]
+        path = os.path.join(self.root, f"{os.path.basename(file_id)}.pdf")
+
+        if not file_id or not os.path.exists(path):
+            self.send_error(404)
+            return
+
+        if random.random() < self.fail_rate:
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        with open(path, "rb") as f:
+            data = f.read()
+        stat = os.stat(path)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+        start = 0
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if match and if_range is not None and if_range != etag:
+            # File changed since the client's partial copy → whole file
+            match = None
+        if match:
+            start = int(match.group(1))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+
+        body = data[start:]
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if random.random() < self.drop_rate:
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        self.wfile.write(body)
+
+
+def serve(root, port=8765, latency=0.0, fail_rate=0.0, drop_rate=0.0):
+    handler = type("Handler", (StandInHandler,), {
+        "root": root,
+        "latency": latency,
+        "fail_rate": fail_rate,
+        "drop_rate": drop_rate,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    print(f"🛰 Drive stand-in serving {root} on http://127.0.0.1:{server.server_port}")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    args = parser.parse_args(sys.argv[1:])
+
+    serve(args.root, args.port, args.latency, args.fail_rate, args.drop_rate).serve_forever()
@@ -0,0 +1,157 @@
+# service.py
+
+"""
+Verification service: single checks and batch runs in one process.
+
+The stage scheduler only arbitrates work inside its own process, so
+interactive checks (main.py) and batch runs (batch_main.py) started as
+separate processes never compete for the same stage workers. Here both
+go through the process-wide scheduler: single checks as INTERACTIVE,
+batches as BULK, with admission control between them.
+
+    python service.py [port]
+
+    POST /verify   {"link": "..."}                          → check result
+    POST /batch    {"links": [...], "retry_failed": false}  → 202, runs in background
+    GET  /batch                                             → batch status / summary
+    GET  /stats                                             → scheduler stats
+"""
+
+import sys
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from main import verify_link
+from batch_main import run_batch
+from utils.scheduler import get_scheduler, DeadlineExceeded
+
+# ---------------- CONFIG ----------------
+
+HOST = "127.0.0.1"
+PORT = 8080
+
+
+def _json_default(value):
+    # Stage results carry numpy scalars
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+# ---------------- BATCH RUNNER ----------------
+
+class BatchRunner:
+    """
+    At most one batch at a time, on a background thread (which owns the
+    batch's JobStore connection).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.status = {"state": "idle"}
+
+    def start(self, links, retry_failed=False):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self.status = {"state": "running", "documents": len(links)}
+            self._thread = threading.Thread(
+                target=self._run, args=(links, retry_failed), name="batch-runner", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def _run(self, links, retry_failed):
+        try:
+            summary = run_batch(links, retry_failed=retry_failed)
+            self.status = {"state": "finished", "documents": len(links), "summary": summary}
+        except Exception as e:
+            self.status = {"state": "failed", "documents": len(links), "error": str(e)}
+
+
+batch_runner = BatchRunner()
+
+
+# ---------------- HTTP ----------------
+
+class Handler(BaseHTTPRequestHandler):
+
+    def _send(self, code, body):
+        data = json.dumps(body, default=_json_default).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send(200, get_scheduler().stats())
+        elif self.path == "/batch":
+            self._send(200, batch_runner.status)
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            body = self._read_json()
+        except ValueError:
+            self._send(400, {"error": "invalid JSON"})
+            return
+
+        if self.path == "/verify":
+            self._verify(body)
+        elif self.path == "/batch":
+            self._batch(body)
+        else:
+            self._send(404, {"error": "not found"})
+
+    def _verify(self, body):
+        link = (body.get("link") or "").strip()
+        if not link:
+            self._send(400, {"error": "link is required"})
+            return
+
+        try:
+            result = verify_link(link, verbose=False)
+        except DeadlineExceeded as e:
+            self._send(504, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+            return
+
+        self._send(422 if "error" in result else 200, result)
+
+    def _batch(self, body):
+        links = [link.strip() for link in body.get("links", []) if link.strip()]
+        if not links:
+            self._send(400, {"error": "links are required"})
+            return
+
+        if not batch_runner.start(links, retry_failed=bool(body.get("retry_failed"))):
+            self._send(409, {"error": "a batch is already running", **batch_runner.status})
+            return
+        self._send(202, batch_runner.status)
+
+    def log_message(self, fmt, *args):
+        print(f"🌐 {self.address_string()} {fmt % args}")
+
+
+def serve(host=HOST, port=PORT):
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"🚀 EduVault service on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve(port=int(sys.argv[1]) if len(sys.argv) > 1 else PORT)
@@ -1,9 +1,52 @@
 # stages/aggregator.py
 
-def aggregate_verdict(pdf_result, phash_result, cnn_result):
+import numpy as np
+
+# Trust points removed when the same page image was already
+# verified under another holder name
+REUSE_PENALTY = 40
+
+DEFAULT_PARAMS = {
+    # Weighted risk
+    "pdf_weight": 0.50,
+    "phash_weight": 0.35,
+    "cnn_weight": 0.15,
+
+    # Confidence boost when all three stages agree
+    "boost": 12,
+    "boost_cap": 95,
+
+    # Verdict bands (lower bounds)
+    "highly_trusted": 85,
+    "mostly_trusted": 65,
+    "needs_review": 45,
+
+    "reuse_penalty": REUSE_PENALTY,
+
+    # Batch path only: when stage verdicts are not passed in, boost
+    # eligibility is derived from the raw scores with the stage thresholds
+    # (pdf SUSPICIOUS_THRESHOLD, phash HAMMING_THRESHOLD, cnn NORMAL_THRESHOLD)
+    "boost_max_forensic_score": 3,
+    "boost_max_hamming": 10,
+    "boost_min_cnn_score": 0.045,
+}
+
+VERDICT_LABELS = np.array(["HIGH_RISK", "NEEDS_REVIEW", "MOSTLY_TRUSTED", "HIGHLY_TRUSTED"])
+
+
+def resolve_params(params=None):
+    if not params:
+        return DEFAULT_PARAMS
+    return {**DEFAULT_PARAMS, **params}
+
+
+def aggregate_verdict(pdf_result, phash_result, cnn_result, duplicate_result=None, params=None):
     """
     Combines PDF forensics, pHash, and CNN anomaly into a final trust score (0–100)
+    duplicate_result (optional) comes from the submission index
+    params (optional) overrides DEFAULT_PARAMS, e.g. from calibration
     """
+    p = resolve_params(params)
 
     # ---------------- PDF NAME FORENSICS ----------------
     forensic_score = pdf_result.get("forensic_score", 0)
@@ -29,37 +72,137 @@ def aggregate_verdict(pdf_result, phash_result, cnn_result):
 
     # ---------------- WEIGHTED AGGREGATION ----------------
     final_risk = (
-        0.50 * pdf_risk +
-        0.35 * phash_risk +
-        0.15 * cnn_risk
+        p["pdf_weight"] * pdf_risk +
+        p["phash_weight"] * phash_risk +
+        p["cnn_weight"] * cnn_risk
     )
 
     trust_score = round((1 - final_risk) * 100, 1)
 
+    # ---------------- SUBMISSION REUSE ----------------
+    reused = (
+        duplicate_result is not None
+        and duplicate_result.get("duplicate_verdict") == "REUSED_UNDER_DIFFERENT_NAME"
+    )
+
     # ---------------- CONFIDENCE BOOST ----------------
     if (
         pdf_verdict == "LIKELY_ORIGINAL"
         and phash_verdict == "VISUALLY_MATCHING"
         and cnn_verdict == "NORMAL"
+        and not reused
     ):
-        trust_score = min(trust_score + 12, 95)
+        trust_score = min(trust_score + p["boost"], p["boost_cap"])
+
+    if reused:
+        trust_score = max(round(trust_score - p["reuse_penalty"], 1), 0.0)
 
     # ---------------- FINAL VERDICT LABEL ----------------
-    if trust_score >= 85:
+    if trust_score >= p["highly_trusted"]:
         final_verdict = "HIGHLY_TRUSTED"
-    elif trust_score >= 65:
+    elif trust_score >= p["mostly_trusted"]:
         final_verdict = "MOSTLY_TRUSTED"
-    elif trust_score >= 45:
+    elif trust_score >= p["needs_review"]:
         final_verdict = "NEEDS_REVIEW"
     else:
         final_verdict = "HIGH_RISK"
 
+    components = {
+        "pdf_risk": round(pdf_risk, 3),
+        "phash_risk": round(phash_risk, 3),
+        "cnn_risk": round(cnn_risk, 3)
+    }
+    if duplicate_result is not None:
+        components["reuse_risk"] = 1.0 if reused else 0.0
+
     return {
         "trust_score": trust_score,
         "final_verdict": final_verdict,
-        "components": {
-            "pdf_risk": round(pdf_risk, 3),
-            "phash_risk": round(phash_risk, 3),
-            "cnn_risk": round(cnn_risk, 3)
-        }
+        "components": components
     }
+
+
+# ---------------- BATCH (COLUMNAR) ----------------
+
+def boost_eligibility(forensic_scores, hamming_distances, cnn_scores, params=None):
+    """
+    Boost mask derived from raw scores, for when stage verdicts are not stored.
+    Matches the per-document rule except that an UNKNOWN pdf verdict
+    (name not found, forensic_score 0) counts as LIKELY_ORIGINAL here.
+    """
+    p = resolve_params(params)
+    return (
+        (np.asarray(forensic_scores) < p["boost_max_forensic_score"])
+        & (np.asarray(hamming_distances) <= p["boost_max_hamming"])
+        & (np.asarray(cnn_scores) >= p["boost_min_cnn_score"])
+    )
+
+
+def risk_components(forensic_scores, hamming_distances, cnn_scores):
+    """
+    Returns (pdf_risk, phash_risk, cnn_risk) as float64 arrays.
+    """
+    f = np.asarray(forensic_scores, dtype=np.float64)
+    h = np.asarray(hamming_distances, dtype=np.float64)
+    c = np.asarray(cnn_scores, dtype=np.float64)
+
+    pdf_risk = f / (f + 4)
+    phash_risk = np.minimum(h / 20, 1.0)
+    cnn_risk = np.clip(0.5 - c, 0.0, 1.0)
+    return pdf_risk, phash_risk, cnn_risk
+
+
+def verdict_labels(trust_scores, params=None):
+    p = resolve_params(params)
+    bands = [p["needs_review"], p["mostly_trusted"], p["highly_trusted"]]
+    return VERDICT_LABELS[np.searchsorted(bands, trust_scores, side="right")]
+
+
+def aggregate_verdict_batch(
+    forensic_scores,
+    hamming_distances,
+    cnn_scores,
+    boost_mask=None,
+    reused_mask=None,
+    params=None
+):
+    """
+    Columnar aggregate_verdict: one call for any number of documents.
+
+    Inputs are 1-D arrays (missing hamming distance → 20, as per document).
+    boost_mask: rows where pdf / pHash / CNN verdicts all agree; derived
+    from the scores with boost_eligibility() when omitted.
+    reused_mask: rows flagged REUSED_UNDER_DIFFERENT_NAME.
+
+    Returns (trust_scores, final_verdicts). The arithmetic is the same as
+    aggregate_verdict; np.round can differ from round() by 0.1 on rare
+    exact-half ties.
+    """
+    p = resolve_params(params)
+    pdf_risk, phash_risk, cnn_risk = risk_components(forensic_scores, hamming_distances, cnn_scores)
+
+    final_risk = (
+        p["pdf_weight"] * pdf_risk +
+        p["phash_weight"] * phash_risk +
+        p["cnn_weight"] * cnn_risk
+    )
+    trust = np.round((1 - final_risk) * 100, 1)
+
+    if boost_mask is None:
+        boost_mask = boost_eligibility(forensic_scores, hamming_distances, cnn_scores, p)
+    boost_mask = np.asarray(boost_mask, dtype=bool)
+
+    if reused_mask is not None:
+        reused_mask = np.asarray(reused_mask, dtype=bool)
+        boost_mask = boost_mask & ~reused_mask
+
+    trust = np.where(boost_mask, np.minimum(trust + p["boost"], p["boost_cap"]), trust)
+
+    if reused_mask is not None:
+        trust = np.where(
+            reused_mask,
+            np.maximum(np.round(trust - p["reuse_penalty"], 1), 0.0),
+            trust
+        )
+
+    return trust, verdict_labels(trust, p)
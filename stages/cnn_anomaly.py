@@ -23,6 +23,8 @@ def load_feature_extractor():
 
     return model
 
+import io
+
 from PIL import Image
 from torchvision import transforms
 
@@ -41,13 +43,33 @@ def get_preprocess_transform():
     ])
 
 
+_transform = get_preprocess_transform()
+
+
+def load_image(source):
+    """
+    Accepts a file path, raw image bytes, a file-like buffer
+    or an already decoded PIL image
+    """
+    if isinstance(source, Image.Image):
+        return source.convert("RGB")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source).convert("RGB")
+
+
+def preprocess_single(source):
+    """
+    Loads and preprocesses one page → (3, 224, 224), no batch dimension
+    """
+    return _transform(load_image(source))
+
+
 def preprocess_image(image_path):
     """
     Loads and preprocesses a certificate image
     """
-    image = Image.open(image_path).convert("RGB")
-    transform = get_preprocess_transform()
-    tensor = transform(image)
+    tensor = preprocess_single(image_path)
 
     # Add batch dimension → (1, 3, 224, 224)
     return tensor.unsqueeze(0)
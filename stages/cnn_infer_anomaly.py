@@ -1,13 +1,20 @@
 # stages/cnn_infer_anomaly.py
 
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
 import joblib
+import numpy as np
 from pathlib import Path
 
 from stages.cnn_anomaly import (
     load_feature_extractor,
-    preprocess_image
+    preprocess_image,
+    preprocess_single
 )
+from stages.cnn_knn_anomaly import run_knn_anomaly, run_knn_anomaly_batch
 
 # ---------------- CONFIG ----------------
 
@@ -16,6 +23,12 @@ MODEL_PATH = "data/cnn_anomaly_model.pkl"
 NORMAL_THRESHOLD = 0.045
 UNUSUAL_THRESHOLD = -0.05
 
+# Batch sizing: a 224px ResNet18 image keeps a few MB of activations
+# live; past ~32 images the working set spills out of cache
+# and per-batch gains flatten, so cap there
+MIN_BATCH_SIZE = 4
+MAX_BATCH_SIZE = 32
+
 
 # ---------------- MODEL LOADERS ----------------
 
@@ -25,6 +38,76 @@ def load_anomaly_model():
     return joblib.load(MODEL_PATH)
 
 
+_cnn = None
+
+_anomaly_model = None
+_anomaly_model_stamp = None
+_reload_lock = threading.Lock()
+_reloading = False
+
+
+def get_feature_extractor():
+    """
+    ResNet18 is loaded once per process.
+    """
+    global _cnn
+    if _cnn is None:
+        _cnn = load_feature_extractor()
+    return _cnn
+
+
+def _model_file_stamp():
+    st = os.stat(MODEL_PATH)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _reload_in_background(stamp):
+    global _anomaly_model, _anomaly_model_stamp, _reloading
+    try:
+        model = load_anomaly_model()
+        _anomaly_model, _anomaly_model_stamp = model, stamp
+    except Exception as e:
+        print(f"⚠ Anomaly model reload failed, keeping current model: {e}")
+    finally:
+        _reloading = False
+
+
+def get_anomaly_model():
+    """
+    Returns the cached IsolationForest.
+
+    The retrain worker publishes new models with an atomic rename, so a
+    changed file stamp means a complete new model is on disk. It is loaded
+    in a background thread while requests keep using the current one.
+    """
+    global _anomaly_model, _anomaly_model_stamp, _reloading
+
+    if _anomaly_model is None:
+        with _reload_lock:
+            if _anomaly_model is None:
+                stamp = _model_file_stamp() if Path(MODEL_PATH).exists() else None
+                _anomaly_model = load_anomaly_model()
+                _anomaly_model_stamp = stamp
+        return _anomaly_model
+
+    try:
+        stamp = _model_file_stamp()
+    except FileNotFoundError:
+        return _anomaly_model
+
+    if stamp != _anomaly_model_stamp:
+        with _reload_lock:
+            if not _reloading and stamp != _anomaly_model_stamp:
+                _reloading = True
+                threading.Thread(
+                    target=_reload_in_background,
+                    args=(stamp,),
+                    daemon=True
+                ).start()
+
+    return _anomaly_model
+
+
 def get_anomaly_verdict(score: float) -> str:
     """
     IsolationForest:
@@ -39,25 +122,136 @@ def get_anomaly_verdict(score: float) -> str:
         return "SUSPICIOUS"
 
 
-# ---------------- PIPELINE FUNCTION ----------------
+# ---------------- PIPELINE FUNCTIONS ----------------
 
-def run_cnn_anomaly(image_path: str) -> dict:
+def extract_embedding(image_path: str):
     """
-    Image path → CNN anomaly detection
+    Image path → 512-D ResNet18 embedding, shape (1, 512)
     """
-
-    cnn = load_feature_extractor()
-    anomaly_model = load_anomaly_model()
-
     x = preprocess_image(image_path)
 
     with torch.no_grad():
-        embedding = cnn(x).numpy()
+        return get_feature_extractor()(x).numpy()
+
 
-    score = anomaly_model.decision_function(embedding)[0]
+def score_embedding(embedding, issuer_id=None) -> dict:
+    """
+    (1, 512) embedding → CNN anomaly result
+    With issuer_id and a built k-NN index, the cnn_knn_* keys are added.
+    """
+    score = get_anomaly_model().decision_function(embedding)[0]
     verdict = get_anomaly_verdict(score)
 
-    return {
+    result = {
         "cnn_anomaly_score": float(score),
         "cnn_anomaly_verdict": verdict
     }
+    if issuer_id is not None:
+        result.update(run_knn_anomaly(embedding, issuer_id))
+
+    return result
+
+
+def run_cnn_anomaly(image_path: str, issuer_id=None) -> dict:
+    """
+    Image path → CNN anomaly detection
+    """
+    return score_embedding(extract_embedding(image_path), issuer_id)
+
+
+# ---------------- BATCHED PIPELINE ----------------
+
+def default_batch_size():
+    """
+    Two images per intra-op thread keeps every core busy
+    without blowing the cache-sized working set.
+    """
+    return max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, 2 * torch.get_num_threads()))
+
+
+def _preprocess_or_error(source):
+    try:
+        return preprocess_single(source), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def extract_embeddings_batch(sources, batch_size=None, workers=None, errors=None):
+    """
+    Paths / bytes / buffers / PIL images → (n, 512) embeddings, input order.
+
+    Images are decoded and resized in a thread pool (PIL releases the GIL);
+    the next batch is preprocessed while the current one runs through the CNN.
+
+    errors: optional dict. When given, an image that fails to load is
+    recorded as errors[index] = message and its row is NaN, instead of
+    the exception aborting the whole batch.
+    """
+    sources = list(sources)
+    if not sources:
+        return np.empty((0, 512), dtype=np.float32)
+
+    batch_size = batch_size or default_batch_size()
+    cnn = get_feature_extractor()
+    starts = range(0, len(sources), batch_size)
+    chunks = [sources[i:i + batch_size] for i in starts]
+    out = np.full((len(sources), 512), np.nan, dtype=np.float32)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = [pool.submit(_preprocess_or_error, s) for s in chunks[0]]
+
+        for i, start in enumerate(starts):
+            current = pending
+            if i + 1 < len(chunks):
+                pending = [pool.submit(_preprocess_or_error, s) for s in chunks[i + 1]]
+
+            tensors, rows = [], []
+            for j, f in enumerate(current):
+                tensor, error = f.result()
+                if error is None:
+                    tensors.append(tensor)
+                    rows.append(start + j)
+                elif errors is None:
+                    raise ValueError(f"❌ Could not load image {start + j}: {error}")
+                else:
+                    errors[start + j] = error
+
+            if tensors:
+                with torch.no_grad():
+                    out[rows] = cnn(torch.stack(tensors)).numpy()
+
+    return out
+
+
+def run_cnn_anomaly_batch(sources, batch_size=None, workers=None, issuer_ids=None) -> list:
+    """
+    Many images → one CNN anomaly result dict per image, in input order.
+    One forward pass per batch, one decision_function over all embeddings.
+    issuer_ids (optional, one per image) enables the k-NN keys.
+    Images that cannot be loaded get {"error": message} and do not
+    affect the others.
+    """
+    errors = {}
+    embeddings = extract_embeddings_batch(sources, batch_size, workers, errors)
+    if len(embeddings) == 0:
+        return []
+
+    ok = np.array([i not in errors for i in range(len(embeddings))])
+    results = [{"error": errors[i]} if i in errors else None for i in range(len(embeddings))]
+    if not ok.any():
+        return results
+
+    scores = get_anomaly_model().decision_function(embeddings[ok])
+    ok_idx = np.flatnonzero(ok)
+
+    for i, score in zip(ok_idx, scores):
+        results[i] = {
+            "cnn_anomaly_score": float(score),
+            "cnn_anomaly_verdict": get_anomaly_verdict(score)
+        }
+    if issuer_ids is not None:
+        knn = run_knn_anomaly_batch(embeddings[ok], [issuer_ids[i] for i in ok_idx])
+        for i, extra in zip(ok_idx, knn):
+            results[i].update(extra)
+
+    return results
@@ -0,0 +1,259 @@
+# stages/cnn_knn_anomaly.py
+
+"""
+Optional nearest-neighbour detector in ResNet18 embedding space.
+
+Normal-template embeddings are L2-normalised and stored compactly
+(int8 with a per-row scale, or float16), grouped by issuer.
+A submission is scored by the mean cosine distance to its k nearest
+templates of the detected issuer, and the nearest template is reported.
+
+Training layout (one folder per issuer, loose files go to "generic"):
+    cnn_training_data/normal/<issuer>/<template>.png
+
+Build the index:
+    python -m stages.cnn_knn_anomaly
+"""
+
+import os
+import threading
+
+import numpy as np
+
+# ---------------- CONFIG ----------------
+
+KNN_TRAIN_DIR = "cnn_training_data/normal"
+KNN_INDEX_PATH = "data/cnn_knn_index.npz"
+
+INDEX_DTYPE = "int8"   # "int8" or "float16"
+GENERIC_ISSUER = "generic"
+
+K_NEIGHBOURS = 3
+
+# Mean cosine distance bands
+KNN_NORMAL_DISTANCE = 0.15
+KNN_UNUSUAL_DISTANCE = 0.30
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+# ---------------- QUANTISATION ----------------
+
+def l2_normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def quantize(unit_vectors, dtype=INDEX_DTYPE):
+    """
+    Returns (stored vectors, per-row scale or None).
+    """
+    if dtype == "float16":
+        return unit_vectors.astype(np.float16), None
+
+    scale = np.abs(unit_vectors).max(axis=1) / 127.0
+    scale = np.maximum(scale, 1e-12).astype(np.float32)
+    q = np.round(unit_vectors / scale[:, None]).astype(np.int8)
+    return q, scale
+
+
+# ---------------- INDEX ----------------
+
+class KnnIndex:
+
+    def __init__(self, vectors, scales, issuers, template_ids):
+        """
+        Rows must be grouped by issuer (build() sorts them).
+        """
+        self.vectors = vectors
+        self.scales = scales
+        self.issuers = issuers
+        self.template_ids = template_ids
+
+        # issuer → (start, end) row range
+        self.groups = {}
+        names, starts, counts = np.unique(issuers, return_index=True, return_counts=True)
+        for name, start, count in zip(names, starts, counts):
+            self.groups[str(name)] = (int(start), int(start + count))
+
+    @classmethod
+    def build(cls, embeddings, issuers, template_ids, dtype=INDEX_DTYPE):
+        order = np.argsort(np.asarray(issuers), kind="stable")
+        unit = l2_normalize(np.asarray(embeddings)[order])
+        vectors, scales = quantize(unit, dtype)
+        return cls(
+            vectors,
+            scales,
+            np.asarray(issuers)[order],
+            np.asarray(template_ids)[order]
+        )
+
+    @classmethod
+    def load(cls, path=KNN_INDEX_PATH):
+        data = np.load(path)
+        scales = data["scales"] if "scales" in data.files else None
+        return cls(data["vectors"], scales, data["issuers"], data["template_ids"])
+
+    def save(self, path=KNN_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {
+            "vectors": self.vectors,
+            "issuers": self.issuers,
+            "template_ids": self.template_ids,
+        }
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def _rows(self, issuer):
+        if issuer in self.groups:
+            return self.groups[issuer], True
+        return (0, len(self.vectors)), False
+
+    def _similarities(self, queries, start, end):
+        block = self.vectors[start:end].astype(np.float32)
+        sims = queries @ block.T
+        if self.scales is not None:
+            sims *= self.scales[start:end]
+        return sims
+
+    def search(self, embeddings, issuers, k=K_NEIGHBOURS):
+        """
+        embeddings: (n, 512), issuers: n issuer ids (None → all templates).
+        One matrix product per distinct issuer in the batch.
+        Returns (mean k-NN cosine distance, nearest template id, issuer matched) per row.
+        """
+        queries = l2_normalize(embeddings)
+        issuers = list(issuers)
+        scores = np.empty(len(queries), dtype=np.float32)
+        nearest = [None] * len(queries)
+        matched = [False] * len(queries)
+
+        by_issuer = {}
+        for i, issuer in enumerate(issuers):
+            by_issuer.setdefault(issuer, []).append(i)
+
+        for issuer, idx in by_issuer.items():
+            (start, end), is_match = self._rows(issuer)
+            sims = self._similarities(queries[idx], start, end)
+
+            kk = min(k, end - start)
+            top = np.argpartition(-sims, kk - 1, axis=1)[:, :kk]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            best = top[np.arange(len(idx)), top_sims.argmax(axis=1)]
+
+            scores[idx] = 1.0 - top_sims.mean(axis=1)
+            for row, b in zip(idx, best):
+                nearest[row] = str(self.template_ids[start + b])
+                matched[row] = is_match
+
+        return scores, nearest, matched
+
+
+# ---------------- BUILD ----------------
+
+def discover_knn_templates(train_dir=KNN_TRAIN_DIR):
+    """
+    Returns [(issuer, template_id, path), ...].
+    """
+    items = []
+    for entry in sorted(os.listdir(train_dir)):
+        path = os.path.join(train_dir, entry)
+        if os.path.isdir(path):
+            for fname in sorted(os.listdir(path)):
+                if fname.lower().endswith(IMAGE_EXTENSIONS):
+                    stem = os.path.splitext(fname)[0]
+                    items.append((entry.lower(), f"{entry.lower()}:{stem}", os.path.join(path, fname)))
+        elif entry.lower().endswith(IMAGE_EXTENSIONS):
+            stem = os.path.splitext(entry)[0]
+            items.append((GENERIC_ISSUER, f"{GENERIC_ISSUER}:{stem}", path))
+    return items
+
+
+def build_knn_index(train_dir=KNN_TRAIN_DIR, out_path=KNN_INDEX_PATH, dtype=INDEX_DTYPE):
+    from stages.cnn_train_anomaly import extract_embeddings_cached
+
+    items = discover_knn_templates(train_dir)
+    if not items:
+        raise FileNotFoundError(f"❌ No template images under {train_dir}")
+
+    embeddings = extract_embeddings_cached([p for _, _, p in items])
+    index = KnnIndex.build(
+        embeddings,
+        [issuer for issuer, _, _ in items],
+        [tid for _, tid, _ in items],
+        dtype
+    )
+    index.save(out_path)
+    return index
+
+
+# ---------------- PIPELINE FUNCTIONS ----------------
+
+_knn_index = None
+_knn_lock = threading.Lock()
+
+
+def get_knn_index():
+    """
+    Cached index, or None when it has not been built (detector disabled).
+    """
+    global _knn_index
+    if _knn_index is None and os.path.exists(KNN_INDEX_PATH):
+        with _knn_lock:
+            if _knn_index is None:
+                _knn_index = KnnIndex.load(KNN_INDEX_PATH)
+    return _knn_index
+
+
+def get_knn_verdict(distance: float) -> str:
+    """
+    Lower distance = closer to a known template = more normal
+    """
+    if distance <= KNN_NORMAL_DISTANCE:
+        return "NORMAL"
+    elif distance <= KNN_UNUSUAL_DISTANCE:
+        return "UNUSUAL"
+    else:
+        return "SUSPICIOUS"
+
+
+def run_knn_anomaly_batch(embeddings, issuer_ids, index=None) -> list:
+    index = index or get_knn_index()
+    if index is None:
+        return [{} for _ in range(len(embeddings))]
+
+    scores, nearest, matched = index.search(embeddings, issuer_ids)
+
+    return [
+        {
+            "cnn_knn_score": float(score),
+            "cnn_knn_verdict": get_knn_verdict(score),
+            "cnn_knn_nearest_template": template,
+            "cnn_knn_issuer_matched": is_match
+        }
+        for score, template, is_match in zip(scores, nearest, matched)
+    ]
+
+
+def run_knn_anomaly(embedding, issuer_id, index=None) -> dict:
+    """
+    (1, 512) embedding + detected issuer → k-NN anomaly result.
+    Empty dict when no index has been built.
+    """
+    return run_knn_anomaly_batch(np.atleast_2d(embedding), [issuer_id], index)[0]
+
+
+if __name__ == "__main__":
+    print("🚀 Building CNN k-NN template index")
+    index = build_knn_index()
+    print(f"✅ {len(index.vectors)} templates, {len(index.groups)} issuers, "
+          f"{index.nbytes / 1024:.1f} KB → {KNN_INDEX_PATH}")
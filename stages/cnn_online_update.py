@@ -0,0 +1,257 @@
+# stages/cnn_online_update.py
+
+"""
+Online updates for the CNN anomaly model.
+
+- Certificates aggregated as HIGHLY_TRUSTED add their embedding to a
+  rolling pool of "normal" embeddings (data/cnn_normal_pool.f32). The
+  document refs already added are kept in data/cnn_normal_pool.refs, so
+  a document is only added once.
+- A background worker retrains the IsolationForest on the cached
+  training-set embeddings + the pool, on a schedule or when the new pool
+  embeddings drift away from the current model.
+- The new model is published with an atomic rename; inference processes
+  pick it up on their next call (see cnn_infer_anomaly.get_anomaly_model).
+
+Run the worker:
+    python -m stages.cnn_online_update          # loop forever
+    python -m stages.cnn_online_update --once   # single check
+"""
+
+import os
+import sys
+import json
+import time
+
+import numpy as np
+
+from stages.cnn_infer_anomaly import MODEL_PATH, load_anomaly_model
+
+# ---------------- CONFIG ----------------
+
+POOL_PATH = "data/cnn_normal_pool.f32"
+STATE_PATH = "data/cnn_retrain_state.json"
+EMBEDDING_DIM = 512
+
+# Rolling pool size: only the newest POOL_MAX embeddings are trained on
+POOL_MAX = 5000
+
+# Worker schedule
+POLL_INTERVAL = 60           # seconds between checks
+RETRAIN_INTERVAL = 6 * 3600  # scheduled retrain, if anything new arrived
+MIN_NEW_SAMPLES = 20
+
+# Drift: retrain early when the new trusted embeddings score this low
+# on average under the current model
+DRIFT_SCORE_THRESHOLD = 0.0
+DRIFT_MIN_SAMPLES = 10
+
+ROW_BYTES = EMBEDDING_DIM * 4
+
+REF_DTYPE = np.dtype("S64")
+
+
+# ---------------- NORMAL POOL ----------------
+
+def add_normal_embedding(embedding, pool_path=POOL_PATH):
+    """
+    Appends one (512,) or (1, 512) embedding to the pool file.
+    """
+    row = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    if row.size != EMBEDDING_DIM:
+        raise ValueError(f"Expected {EMBEDDING_DIM}-D embedding, got {row.size}")
+
+    os.makedirs(os.path.dirname(pool_path) or ".", exist_ok=True)
+    with open(pool_path, "ab") as f:
+        f.write(row.tobytes())
+
+
+def refs_path(pool_path=POOL_PATH):
+    return os.path.splitext(pool_path)[0] + ".refs"
+
+
+def _ref_bytes(doc_ref):
+    return str(doc_ref).encode("utf-8")[:REF_DTYPE.itemsize]
+
+
+def load_pool_refs(pool_path=POOL_PATH):
+    path = refs_path(pool_path)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=REF_DTYPE)
+    count = os.path.getsize(path) // REF_DTYPE.itemsize
+    return np.fromfile(path, dtype=REF_DTYPE, count=count)
+
+
+def pool_has_ref(doc_ref, pool_path=POOL_PATH):
+    return bool((load_pool_refs(pool_path) == _ref_bytes(doc_ref)).any())
+
+
+def record_trusted_embedding(final_result, embedding, pool_path=POOL_PATH, doc_ref=None):
+    """
+    Pipeline hook: only HIGHLY_TRUSTED certificates grow the normal pool.
+    With doc_ref, a document already in the pool is not added again.
+    The ref is written before the embedding: a crash in between loses
+    that one sample rather than adding it twice on the next run.
+    """
+    if final_result.get("final_verdict") != "HIGHLY_TRUSTED":
+        return False
+
+    if doc_ref is not None:
+        if pool_has_ref(doc_ref, pool_path):
+            return False
+        os.makedirs(os.path.dirname(pool_path) or ".", exist_ok=True)
+        with open(refs_path(pool_path), "ab") as f:
+            f.write(np.array([_ref_bytes(doc_ref)], dtype=REF_DTYPE).tobytes())
+
+    add_normal_embedding(embedding, pool_path)
+    return True
+
+
+def pool_size(pool_path=POOL_PATH):
+    if not os.path.exists(pool_path):
+        return 0
+    return os.path.getsize(pool_path) // ROW_BYTES
+
+
+def load_normal_pool(pool_path=POOL_PATH, max_rows=POOL_MAX):
+    """
+    Returns the newest max_rows embeddings, shape (n, 512).
+    A torn trailing row (append in progress) is ignored.
+    """
+    rows = pool_size(pool_path)
+    if rows == 0:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+    start = max(0, rows - max_rows)
+    pool = np.fromfile(
+        pool_path,
+        dtype=np.float32,
+        count=(rows - start) * EMBEDDING_DIM,
+        offset=start * ROW_BYTES
+    )
+    return pool.reshape(-1, EMBEDDING_DIM)
+
+
+def compact_pool(pool_path=POOL_PATH, max_rows=POOL_MAX):
+    """
+    Rewrites the pool (and its refs) with only the newest max_rows rows.
+    An append racing with the rename can be lost; that is one trusted
+    sample, which is acceptable for a rolling pool.
+    """
+    pool = load_normal_pool(pool_path, max_rows)
+    tmp = pool_path + ".tmp"
+    pool.tofile(tmp)
+    os.replace(tmp, pool_path)
+
+    refs = load_pool_refs(pool_path)
+    if len(refs):
+        tmp = refs_path(pool_path) + ".tmp"
+        refs[-max_rows:].tofile(tmp)
+        os.replace(tmp, refs_path(pool_path))
+    return len(pool)
+
+
+# ---------------- RETRAIN WORKER ----------------
+
+class RetrainWorker:
+
+    def __init__(self, pool_path=POOL_PATH, state_path=STATE_PATH):
+        self.pool_path = pool_path
+        self.state_path = state_path
+        self.rows_at_last_train = 0
+        self.last_train_time = 0.0
+        self.load_state()
+
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+            self.rows_at_last_train = state.get("rows_at_last_train", 0)
+            self.last_train_time = state.get("last_train_time", 0.0)
+
+    def save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "rows_at_last_train": self.rows_at_last_train,
+                "last_train_time": self.last_train_time
+            }, f)
+        os.replace(tmp, self.state_path)
+
+    def new_embeddings(self):
+        rows = pool_size(self.pool_path)
+        if rows < self.rows_at_last_train:
+            # Pool was compacted elsewhere → treat everything as seen
+            self.rows_at_last_train = rows
+        return load_normal_pool(self.pool_path, rows - self.rows_at_last_train)
+
+    def drift_score(self, embeddings):
+        return float(load_anomaly_model().decision_function(embeddings).mean())
+
+    def should_retrain(self):
+        new = self.new_embeddings()
+        if len(new) == 0:
+            return False, "no new trusted embeddings"
+
+        if len(new) >= DRIFT_MIN_SAMPLES and os.path.exists(MODEL_PATH):
+            score = self.drift_score(new)
+            if score < DRIFT_SCORE_THRESHOLD:
+                return True, f"drift (mean score {score:.3f} on {len(new)} new)"
+
+        due = time.time() - self.last_train_time >= RETRAIN_INTERVAL
+        if due and len(new) >= MIN_NEW_SAMPLES:
+            return True, f"scheduled ({len(new)} new)"
+
+        return False, f"{len(new)} new, not due"
+
+    def retrain(self):
+        from stages.cnn_train_anomaly import (
+            load_training_images,
+            extract_embeddings_cached,
+            train_anomaly_model,
+            publish_model
+        )
+
+        if pool_size(self.pool_path) > 2 * POOL_MAX:
+            compact_pool(self.pool_path)
+
+        pool = load_normal_pool(self.pool_path)
+        base = extract_embeddings_cached(load_training_images())
+        embeddings = np.concatenate([base, pool])
+
+        model = train_anomaly_model(embeddings)
+        publish_model(model)
+
+        self.rows_at_last_train = pool_size(self.pool_path)
+        self.last_train_time = time.time()
+        self.save_state()
+        return len(embeddings)
+
+    def run_once(self):
+        retrain, reason = self.should_retrain()
+        if not retrain:
+            return False, reason
+
+        n = self.retrain()
+        return True, f"{reason} → retrained on {n} embeddings"
+
+    def run_forever(self, poll_interval=POLL_INTERVAL):
+        print("🔁 CNN anomaly retrain worker started")
+        while True:
+            try:
+                retrained, reason = self.run_once()
+                if retrained:
+                    print(f"✅ Model published: {reason}")
+            except Exception as e:
+                print(f"❌ Retrain check failed: {e}")
+            time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    worker = RetrainWorker()
+
+    if "--once" in sys.argv:
+        retrained, reason = worker.run_once()
+        print(("✅ " if retrained else "⏭ ") + reason)
+    else:
+        worker.run_forever()
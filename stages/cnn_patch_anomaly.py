@@ -0,0 +1,336 @@
+# stages/cnn_patch_anomaly.py
+
+"""
+Patch-level CNN anomaly check for localised edits.
+
+The page-level check squashes the 300-DPI certificate to 224x224, which
+averages away a pasted-in name or an altered date. Here the page is cut
+into a GRID_ROWS x GRID_COLS grid of tiles, plus square crops around the
+name and any dates, both located from OCR boxes. All patches go
+through ResNet18 in one batched forward pass, and each is scored by the
+IsolationForest trained for its region key:
+
+    tile_<row>_<col>   → fixed grid position
+    name, date         → text regions, wherever they sit on the page
+
+Regions without a trained model are left unscored. The result carries a
+grid heatmap of tile scores, the name/date scores and the worst patch.
+
+The pipeline calls run_page_and_patch_anomaly: the page is decoded once
+and the whole-page input of the page-level check rides in the same
+forward pass as the patches.
+
+Train the per-region models on the page model's normal images:
+    python -m stages.cnn_patch_anomaly [--tiles-only]
+"""
+
+import re
+import sys
+import threading
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.ensemble import IsolationForest
+
+from stages.cnn_anomaly import load_image
+from stages.ocr import extract_text, ocr_bbox_to_box, find_name_box
+from stages.cnn_infer_anomaly import extract_embeddings_batch, score_embedding
+
+# ---------------- CONFIG ----------------
+
+PATCH_MODEL_PATH = "data/cnn_patch_model.pkl"
+
+# A landscape A4 page at 300 DPI (3508x2480) gives ~880x830 px tiles
+GRID_ROWS = 3
+GRID_COLS = 4
+
+# Text regions are cropped square (Resize would squash a wide name box)
+# with this much context around them
+REGION_MARGIN = 0.25
+MIN_REGION_SIDE = 224
+
+# The worst of ~15 patches decides, so each region model is held to a
+# tighter false-alarm rate than the page model
+PATCH_CONTAMINATION = 0.01
+MIN_REGION_SAMPLES = 5
+
+PATCH_NORMAL_THRESHOLD = 0.0
+PATCH_UNUSUAL_THRESHOLD = -0.05
+
+MONTHS = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+DATE_PATTERN = re.compile(
+    r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b"             # 12/03/2024
+    r"|\b\d{4}[/.-]\d{1,2}[/.-]\d{1,2}\b"              # 2024-03-12
+    rf"|\b\d{{1,2}}(?:st|nd|rd|th)?\s+{MONTHS},?\s+\d{{4}}\b"  # 12 March 2024
+    rf"|\b{MONTHS}\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}\b"  # March 12, 2024
+    rf"|\b{MONTHS}\s+\d{{4}}\b",                       # March 2024
+    re.IGNORECASE
+)
+
+
+# ---------------- PATCH GEOMETRY ----------------
+
+def tile_boxes(width, height, rows=GRID_ROWS, cols=GRID_COLS):
+    """
+    [(key, (x0, y0, x1, y1)), ...] covering the page, row-major.
+    """
+    xs = np.linspace(0, width, cols + 1).round().astype(int)
+    ys = np.linspace(0, height, rows + 1).round().astype(int)
+    return [
+        (f"tile_{r}_{c}", (int(xs[c]), int(ys[r]), int(xs[c + 1]), int(ys[r + 1])))
+        for r in range(rows)
+        for c in range(cols)
+    ]
+
+
+def square_box(box, width, height, margin=REGION_MARGIN):
+    """
+    Square crop centred on box, padded by margin and kept inside the page.
+    """
+    x0, y0, x1, y1 = box
+    side = max(x1 - x0, y1 - y0) * (1 + 2 * margin)
+    side = int(min(max(side, MIN_REGION_SIDE), width, height))
+
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    left = int(min(max(cx - side / 2, 0), width - side))
+    top = int(min(max(cy - side / 2, 0), height - side))
+    return (left, top, left + side, top + side)
+
+
+def find_text_regions(ocr_out=None):
+    """
+    [(key, box), ...] for the name and every date on the page.
+
+    Training images have no PDF, so training and inference both use the
+    OCR locator (find_name_box): the region models only ever see crops
+    picked the same way.
+    """
+    blocks = (ocr_out or {}).get("text_blocks", [])
+    regions = []
+
+    name = find_name_box(ocr_out)
+    if name is not None:
+        regions.append(("name", name))
+
+    for b in blocks:
+        if DATE_PATTERN.search(b["text"]):
+            regions.append(("date", ocr_bbox_to_box(b["bbox"])))
+
+    return regions
+
+
+def patch_boxes(width, height, regions=(), grid=(GRID_ROWS, GRID_COLS)):
+    boxes = tile_boxes(width, height, *grid)
+    for key, box in regions:
+        boxes.append((key, square_box(box, width, height)))
+    return boxes
+
+
+# ---------------- EMBEDDING ----------------
+
+def extract_patch_embeddings(image, boxes):
+    """
+    Crops every box and runs them through ResNet18 as a single batch
+    → (n_patches, 512).
+    """
+    crops = [image.crop(box) for _, box in boxes]
+    return extract_embeddings_batch(crops, batch_size=max(len(crops), 1))
+
+
+# ---------------- MODEL ----------------
+
+def load_patch_model():
+    if not Path(PATCH_MODEL_PATH).exists():
+        raise FileNotFoundError("❌ CNN patch model not found. Train it first.")
+    return joblib.load(PATCH_MODEL_PATH)
+
+
+_patch_model = None
+_patch_lock = threading.Lock()
+
+
+def get_patch_model():
+    """
+    Cached {"grid": (rows, cols), "models": {region: IsolationForest}},
+    or None when it has not been trained (patch check disabled).
+    """
+    global _patch_model
+    if _patch_model is None and Path(PATCH_MODEL_PATH).exists():
+        with _patch_lock:
+            if _patch_model is None:
+                _patch_model = load_patch_model()
+    return _patch_model
+
+
+def get_patch_verdict(score: float) -> str:
+    """
+    Per-region IsolationForest, worst patch:
+    Higher score = more normal
+    """
+    if score >= PATCH_NORMAL_THRESHOLD:
+        return "NORMAL"
+    elif score >= PATCH_UNUSUAL_THRESHOLD:
+        return "UNUSUAL"
+    else:
+        return "SUSPICIOUS"
+
+
+def score_patches(keys, embeddings, models):
+    """
+    One decision_function per region key. NaN where no model exists.
+    """
+    scores = np.full(len(keys), np.nan, dtype=np.float32)
+
+    by_key = {}
+    for i, key in enumerate(keys):
+        by_key.setdefault(key, []).append(i)
+
+    for key, idx in by_key.items():
+        if key in models:
+            scores[idx] = models[key].decision_function(embeddings[idx])
+
+    return scores
+
+
+# ---------------- PIPELINE FUNCTIONS ----------------
+
+def _score(value):
+    return None if np.isnan(value) else round(float(value), 4)
+
+
+def _patch_layout(image, ocr_out, patch_model):
+    rows, cols = patch_model["grid"]
+    return patch_boxes(*image.size, find_text_regions(ocr_out), (rows, cols))
+
+
+def patch_result(boxes, embeddings, patch_model) -> dict:
+    """
+    Patch embeddings (one per box) → patch-level CNN anomaly result.
+    """
+    rows, cols = patch_model["grid"]
+    keys = [key for key, _ in boxes]
+    scores = score_patches(keys, embeddings, patch_model["models"])
+
+    n_tiles = rows * cols
+    heatmap = [
+        [_score(scores[r * cols + c]) for c in range(cols)]
+        for r in range(rows)
+    ]
+    regions = [
+        {"region": key, "bbox": list(box), "score": _score(score)}
+        for (key, box), score in zip(boxes[n_tiles:], scores[n_tiles:])
+    ]
+
+    result = {
+        "cnn_patch_heatmap": heatmap,
+        "cnn_patch_regions": regions
+    }
+
+    if np.isnan(scores).all():
+        return result
+
+    worst = int(np.nanargmin(scores))
+    result.update({
+        "cnn_patch_score": _score(scores[worst]),
+        "cnn_patch_verdict": get_patch_verdict(scores[worst]),
+        "cnn_patch_worst_region": keys[worst],
+        "cnn_patch_worst_bbox": list(boxes[worst][1])
+    })
+    return result
+
+
+def run_patch_anomaly(source, ocr_out=None, patch_model=None) -> dict:
+    """
+    Page image (path / bytes / PIL) → patch-level CNN anomaly result.
+    Empty dict when no patch model has been trained.
+    """
+    patch_model = patch_model or get_patch_model()
+    if patch_model is None:
+        return {}
+
+    image = load_image(source)
+    boxes = _patch_layout(image, ocr_out, patch_model)
+    return patch_result(boxes, extract_patch_embeddings(image, boxes), patch_model)
+
+
+def run_page_and_patch_anomaly(source, ocr_out=None, issuer_id=None, patch_model=None):
+    """
+    Page image → (page embedding (1, 512), CNN anomaly result).
+
+    The image is decoded once; the whole page (resized like the
+    page-level check) and every patch go through ResNet18 as one batch.
+    Row 0 is the page embedding for score_embedding, the rest are the
+    patches. Without a patch model only the page is embedded.
+    """
+    patch_model = patch_model or get_patch_model()
+    image = load_image(source)
+    boxes = _patch_layout(image, ocr_out, patch_model) if patch_model is not None else []
+
+    crops = [image] + [image.crop(box) for _, box in boxes]
+    embeddings = extract_embeddings_batch(crops, batch_size=len(crops))
+
+    page_embedding = embeddings[:1]
+    result = score_embedding(page_embedding, issuer_id)
+    if boxes:
+        result.update(patch_result(boxes, embeddings[1:], patch_model))
+    return page_embedding, result
+
+
+# ---------------- TRAINING ----------------
+
+def collect_patch_embeddings(image_paths, use_ocr=True, grid=(GRID_ROWS, GRID_COLS)):
+    """
+    Returns {region key: (n, 512) embeddings} over all training images.
+    One batched forward pass per image.
+    """
+    per_key = {}
+    for path in image_paths:
+        image = load_image(path)
+        regions = find_text_regions(ocr_out=extract_text(path)) if use_ocr else []
+
+        boxes = patch_boxes(*image.size, regions, grid)
+        embeddings = extract_patch_embeddings(image, boxes)
+        for (key, _), emb in zip(boxes, embeddings):
+            per_key.setdefault(key, []).append(emb)
+
+    return {key: np.stack(embs) for key, embs in per_key.items()}
+
+
+def train_region_model(embeddings):
+    model = IsolationForest(
+        n_estimators=200,
+        contamination=PATCH_CONTAMINATION,
+        random_state=42,
+        n_jobs=-1
+    )
+    model.fit(embeddings)
+    return model
+
+
+def train_patch_models(image_paths, use_ocr=True, grid=(GRID_ROWS, GRID_COLS)):
+    per_key = collect_patch_embeddings(image_paths, use_ocr, grid)
+
+    models = {}
+    for key, embeddings in sorted(per_key.items()):
+        if len(embeddings) < MIN_REGION_SAMPLES:
+            print(f"⚠ Skipping region {key}: only {len(embeddings)} samples")
+            continue
+        models[key] = train_region_model(embeddings)
+
+    return {"grid": tuple(grid), "models": models}
+
+
+if __name__ == "__main__":
+    from stages.cnn_train_anomaly import load_training_images, publish_model
+
+    print("🚀 Training CNN patch anomaly models")
+
+    image_paths = load_training_images()
+    print(f"📸 Found {len(image_paths)} training images")
+
+    patch_model = train_patch_models(image_paths, use_ocr="--tiles-only" not in sys.argv)
+
+    publish_model(patch_model, PATCH_MODEL_PATH)
+
+    print(f"✅ {len(patch_model['models'])} region models saved to {PATCH_MODEL_PATH}")
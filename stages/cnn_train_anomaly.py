@@ -10,21 +10,23 @@ from stages.cnn_anomaly import (
     load_feature_extractor,
     preprocess_image
 )
+from stages.cnn_knn_anomaly import discover_knn_templates
 
 # ---------------- CONFIG ----------------
 
 TRAIN_DIR = "cnn_training_data/normal"
 MODEL_OUT = "data/cnn_anomaly_model.pkl"
+EMBEDDING_CACHE = "data/cnn_embedding_cache.npz"
 
 # ---------------------------------------
 
 
-def load_training_images():
-    images = []
-    for fname in os.listdir(TRAIN_DIR):
-        if fname.lower().endswith((".png", ".jpg", ".jpeg")):
-            images.append(os.path.join(TRAIN_DIR, fname))
-    return images
+def load_training_images(train_dir=TRAIN_DIR):
+    """
+    Loose images and issuer folders (<issuer>/<template>.png) alike,
+    same discovery as the k-NN index.
+    """
+    return [path for _, _, path in discover_knn_templates(train_dir)]
 
 
 def extract_embeddings(model, image_paths):
@@ -40,35 +42,93 @@ def extract_embeddings(model, image_paths):
     return np.array(embeddings)
 
 
+# ---------------- EMBEDDING CACHE ----------------
+
+def embedding_cache_key(path):
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}"
+
+
+def load_embedding_cache(cache_path=EMBEDDING_CACHE):
+    if not os.path.exists(cache_path):
+        return {}
+    data = np.load(cache_path)
+    return dict(zip(data["keys"].tolist(), data["embeddings"]))
+
+
+def save_embedding_cache(cache, cache_path=EMBEDDING_CACHE):
+    if not cache:
+        return
+    keys = list(cache)
+    tmp = cache_path + ".tmp.npz"
+    np.savez(tmp, keys=np.array(keys), embeddings=np.stack([cache[k] for k in keys]))
+    os.replace(tmp, cache_path)
+
+
+def extract_embeddings_cached(image_paths, model=None, cache_path=EMBEDDING_CACHE):
+    """
+    Like extract_embeddings, but only images that are new or changed
+    since the last run go through the CNN.
+    The model is only loaded when something needs embedding.
+    """
+    cache = load_embedding_cache(cache_path)
+    keys = [embedding_cache_key(p) for p in image_paths]
+    missing = [(k, p) for k, p in zip(keys, image_paths) if k not in cache]
+
+    if missing:
+        model = model or load_feature_extractor()
+        fresh = extract_embeddings(model, [p for _, p in missing])
+        for (k, _), emb in zip(missing, fresh):
+            cache[k] = emb
+
+        # Drop entries for deleted / modified files
+        cache = {k: cache[k] for k in keys}
+        save_embedding_cache(cache, cache_path)
+
+    if not keys:
+        return np.empty((0, 512), dtype=np.float32)
+    return np.stack([cache[k] for k in keys])
+
+
+# ---------------- TRAIN + PUBLISH ----------------
+
 def train_anomaly_model(embeddings):
     model = IsolationForest(
         n_estimators=200,
         contamination=0.1,   # conservative
-        random_state=42
+        random_state=42,
+        n_jobs=-1            # build trees in parallel
     )
     model.fit(embeddings)
     return model
 
 
+def publish_model(model, model_out=MODEL_OUT):
+    """
+    Writes next to the target then renames over it, so inference
+    processes never see a half-written pickle.
+    """
+    os.makedirs(os.path.dirname(model_out) or ".", exist_ok=True)
+    tmp = f"{model_out}.tmp.{os.getpid()}"
+    joblib.dump(model, tmp)
+    os.replace(tmp, model_out)
+
+
 if __name__ == "__main__":
     print("🚀 Training CNN Anomaly Model")
 
-    # 1️⃣ Load CNN feature extractor
-    cnn = load_feature_extractor()
-
-    # 2️⃣ Load training images
+    # 1️⃣ Load training images
     image_paths = load_training_images()
     print(f"📸 Found {len(image_paths)} training images")
 
-    # 3️⃣ Extract embeddings
-    embeddings = extract_embeddings(cnn, image_paths)
+    # 2️⃣ Extract embeddings (cached across runs)
+    embeddings = extract_embeddings_cached(image_paths)
     print("🧠 Embeddings shape:", embeddings.shape)
 
-    # 4️⃣ Train Isolation Forest
+    # 3️⃣ Train Isolation Forest
     anomaly_model = train_anomaly_model(embeddings)
 
-    # 5️⃣ Save model
-    os.makedirs("data", exist_ok=True)
-    joblib.dump(anomaly_model, MODEL_OUT)
+    # 4️⃣ Save model
+    publish_model(anomaly_model)
 
     print(f"✅ Anomaly model saved to {MODEL_OUT}")
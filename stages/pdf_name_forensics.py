@@ -2,9 +2,10 @@
 
 import fitz  # PyMuPDF
 import os
-import requests
 from urllib.parse import urlparse, parse_qs
 
+from utils.downloader import download_file, drive_download_url
+
 # ---------------- CONFIG ----------------
 
 TEMP_DIR = "temp_pdfs"
@@ -33,17 +34,9 @@ def download_pdf_from_drive(link: str) -> str:
     if not file_id:
         raise ValueError("Unable to extract file ID")
 
-    url = f"https://drive.google.com/uc?export=download&id={file_id}"
     out_path = os.path.join(TEMP_DIR, f"temp_{file_id}.pdf")
 
-    r = requests.get(url, stream=True)
-    r.raise_for_status()
-
-    with open(out_path, "wb") as f:
-        for chunk in r.iter_content(8192):
-            f.write(chunk)
-
-    return out_path
+    return download_file(drive_download_url(file_id), out_path)
 
 
 # ---------------- FORENSICS ----------------
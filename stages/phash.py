@@ -83,16 +83,23 @@ def detect_issuer(ocr_text: str, image_path: str) -> str:
 
 # ------------------ DB HELPERS ------------------
 
-def get_next_unknown_id():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+def ensure_baseline_docs(conn):
+    """
+    doc_ref → issuer_id of the baseline that document created.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS issuer_baseline_docs (
+            doc_ref TEXT PRIMARY KEY,
+            issuer_id TEXT NOT NULL
+        )
+    """)
 
-    cur.execute("""
+
+def _next_unknown_id(conn):
+    rows = conn.execute("""
         SELECT issuer_id FROM issuer_phash
         WHERE issuer_id LIKE 'unknown_%'
-    """)
-    rows = cur.fetchall()
-    conn.close()
+    """).fetchall()
 
     if not rows:
         return "unknown_1"
@@ -101,6 +108,32 @@ def get_next_unknown_id():
     return f"unknown_{max(nums) + 1}"
 
 
+def get_next_unknown_id():
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return _next_unknown_id(conn)
+    finally:
+        conn.close()
+
+
+def baseline_created_by(doc_ref):
+    """
+    issuer_id of the baseline created by this document, or None.
+    """
+    if doc_ref is None:
+        return None
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        ensure_baseline_docs(conn)
+        row = conn.execute(
+            "SELECT issuer_id FROM issuer_baseline_docs WHERE doc_ref = ?", (doc_ref,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
 def get_all_issuer_phashes(issuer_prefix):
     """
     Returns ALL template phashes for an issuer.
@@ -120,52 +153,95 @@ def get_all_issuer_phashes(issuer_prefix):
     return rows
 
 
-def insert_new_issuer(issuer_id, issuer_name, phash):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+def insert_new_issuer(issuer_id, issuer_name, phash, doc_ref=None):
+    """
+    Writes a baseline row and returns its issuer_id.
+    issuer_id=None allocates the next unknown_N in the same transaction.
+    With doc_ref, a document that already created a baseline gets that
+    issuer_id back and nothing is written, so a replayed batch stage
+    cannot add a second unknown_N for the same certificate.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    try:
+        ensure_baseline_docs(conn)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = None
+            if doc_ref is not None:
+                row = conn.execute(
+                    "SELECT issuer_id FROM issuer_baseline_docs WHERE doc_ref = ?", (doc_ref,)
+                ).fetchone()
+
+            if row is not None:
+                issuer_id = row[0]
+            else:
+                if issuer_id is None:
+                    issuer_id = _next_unknown_id(conn)
+                conn.execute("""
+                    INSERT OR REPLACE INTO issuer_phash (issuer_id, issuer_name, phash)
+                    VALUES (?, ?, ?)
+                """, (issuer_id, issuer_name, phash))
+                if doc_ref is not None:
+                    conn.execute("""
+                        INSERT INTO issuer_baseline_docs (doc_ref, issuer_id)
+                        VALUES (?, ?)
+                    """, (doc_ref, issuer_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    return issuer_id
+
+
+def baseline_result(issuer_id, phash):
+    return {
+        "issuer_id": issuer_id,
+        "phash": phash,
+        "baseline_exists": False,
+        "phash_verdict": (
+            "UNKNOWN_BASELINE_CREATED"
+            if issuer_id.startswith("unknown_")
+            else "BASELINE_CREATED"
+        )
+    }
 
-    cur.execute("""
-        INSERT OR REPLACE INTO issuer_phash (issuer_id, issuer_name, phash)
-        VALUES (?, ?, ?)
-    """, (issuer_id, issuer_name, phash))
 
-    conn.commit()
-    conn.close()
+# ------------------ MAIN pHASH PIPELINE ------------------
 
+def process_phash_for_image(image_path: str, ocr_text: str, doc_ref=None) -> dict:
+    """
+    doc_ref identifies the document (e.g. "<drive file id>:p1"). Checking
+    the same document again returns the baseline it created the first
+    time instead of creating another one.
+    """
+    current_phash = compute_phash(image_path)
 
-# ------------------ MAIN pHASH PIPELINE ------------------
+    created = baseline_created_by(doc_ref)
+    if created is not None:
+        return baseline_result(created, current_phash)
 
-def process_phash_for_image(image_path: str, ocr_text: str) -> dict:
     detected_issuer = detect_issuer(ocr_text, image_path)
-    current_phash = compute_phash(image_path)
 
     # -------- UNKNOWN ISSUER --------
     if detected_issuer == "unknown":
-        uid = get_next_unknown_id()
-        insert_new_issuer(uid, "Unknown Issuer", current_phash)
-
-        return {
-            "issuer_id": uid,
-            "phash": current_phash,
-            "baseline_exists": False,
-            "phash_verdict": "UNKNOWN_BASELINE_CREATED"
-        }
+        uid = insert_new_issuer(None, "Unknown Issuer", current_phash, doc_ref)
+        return baseline_result(uid, current_phash)
 
     # -------- MULTI-TEMPLATE COMPARISON --------
     baselines = get_all_issuer_phashes(detected_issuer)
 
     if not baselines:
-        insert_new_issuer(
+        issuer_id = insert_new_issuer(
             detected_issuer,
             detected_issuer.replace("_", " ").title(),
-            current_phash
+            current_phash,
+            doc_ref
         )
-        return {
-            "issuer_id": detected_issuer,
-            "phash": current_phash,
-            "baseline_exists": False,
-            "phash_verdict": "BASELINE_CREATED"
-        }
+        return baseline_result(issuer_id, current_phash)
 
     # Compare against ALL templates
     distances = []
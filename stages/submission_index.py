@@ -0,0 +1,440 @@
+# stages/submission_index.py
+
+"""
+Append-only near-duplicate index of every verified certificate.
+
+Layout on disk (INDEX_DIR):
+    journal.bin             → newest records, appended one by one
+    seg_00001.rec.npy       → sealed records (memory-mapped)
+    seg_00001.keys.npy      → (NUM_CHUNKS, n) sorted 16-bit chunk keys
+    seg_00001.pos.npy       → (NUM_CHUNKS, n) record position for each key
+
+The key is a holder fingerprint, not the page pHash: one template issued
+to different holders gives page hashes 0-2 bits apart, so the page hash
+alone would call every holder of a popular template a duplicate. The
+fingerprint is a DCT hash of the tight ink box of the holder name line
+(located by OCR). It survives re-encoding, re-rendering and cropping
+(<= 2 bits) but moves >= 6 bits for a one-letter name change. A match
+also needs the page pHash within PAGE_MAX_DISTANCE (same template).
+
+Lookup uses multi-index hashing: the 64-bit key is split into
+NUM_CHUNKS 16-bit chunks. If two hashes are within distance k, at least
+one chunk is within k // NUM_CHUNKS (pigeonhole), so only the buckets
+around each chunk need to be probed before the exact distance check.
+
+Several writers (processes or threads) may share one index; see
+SubmissionIndex.
+"""
+
+import os
+import glob
+import time
+
+import numpy as np
+from PIL import Image
+from scipy.fft import dctn
+
+from stages.ocr import find_name_box
+from utils.file_lock import FileLock
+
+# ---------------- CONFIG ----------------
+
+INDEX_DIR = "data/submission_index"
+JOURNAL_NAME = "journal.bin"
+LOCK_NAME = ".lock"
+
+NUM_CHUNKS = 4
+CHUNK_BITS = 64 // NUM_CHUNKS
+
+# Journal is sealed into a memory-mapped segment after this many records
+SEGMENT_SIZE = 65536
+
+# Holder fingerprint: copies of one certificate stay within 2 bits,
+# different holders (even one letter apart) are >= 6 bits away
+DEFAULT_MAX_DISTANCE = 3
+
+# Page pHash: same template, allowing for crops and re-renders
+PAGE_MAX_DISTANCE = 10
+
+# Fingerprint = sign of the 4x16 low-frequency DCT block of the name
+# line resized to 256x32 (wide text keeps its horizontal detail)
+HOLDER_SIZE = (256, 32)
+HOLDER_DCT = (4, 16)
+INK_LEVEL = 128
+NAME_PAD = 0.5   # search margin around the OCR box, in box heights
+
+# Matches returned as dicts by query(); counting covers all of them
+MAX_REPORTED_MATCHES = 10
+
+RECORD_DTYPE = np.dtype([
+    ("holder", "<u8"),             # holder fingerprint, the index key
+    ("phash", "<u8"),              # page pHash
+    ("ts", "<i8"),
+    ("ref", "S64"),
+    ("name", "S64"),
+])
+
+
+# ---------------- HASH UTILS ----------------
+
+def phash_to_uint64(phash_hex: str) -> np.uint64:
+    return np.uint64(int(phash_hex, 16))
+
+
+def chunk_keys(hashes, chunk):
+    shift = np.uint64(chunk * CHUNK_BITS)
+    return ((hashes >> shift) & np.uint64(0xFFFF)).astype(np.uint16)
+
+
+_PROBE_MASKS = {}
+
+
+def probe_masks(radius):
+    """
+    All 16-bit XOR masks with popcount <= radius (cached).
+    """
+    if radius not in _PROBE_MASKS:
+        values = np.arange(1 << CHUNK_BITS, dtype=np.uint16)
+        _PROBE_MASKS[radius] = values[np.bitwise_count(values) <= radius]
+    return _PROBE_MASKS[radius]
+
+
+def holder_fingerprint(image_path, ocr_out):
+    """
+    64-bit hex fingerprint of the holder name line, or None when OCR
+    found no name line or it holds no ink.
+    """
+    box = find_name_box(ocr_out)
+    if box is None:
+        return None
+
+    x0, y0, x1, y1 = box
+    pad = int((y1 - y0) * NAME_PAD)
+    with Image.open(image_path) as img:
+        region = img.convert("L").crop((max(0, x0 - pad), max(0, y0 - pad), x1 + pad, y1 + pad))
+
+    # Tight ink box: independent of OCR box jitter, crops and scale
+    ink = np.asarray(region) < INK_LEVEL
+    rows, cols = np.flatnonzero(ink.any(axis=1)), np.flatnonzero(ink.any(axis=0))
+    if len(rows) == 0:
+        return None
+    region = region.crop((cols[0], rows[0], cols[-1] + 1, rows[-1] + 1))
+
+    pixels = np.asarray(region.resize(HOLDER_SIZE, Image.LANCZOS), dtype=np.float32)
+    coeffs = dctn(pixels, norm="ortho")[:HOLDER_DCT[0], :HOLDER_DCT[1]].ravel()
+    bits = coeffs > np.median(coeffs)
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+
+def normalize_name(name):
+    return " ".join((name or "").lower().split())
+
+
+# ---------------- SEGMENT ----------------
+
+class Segment:
+    """
+    Sealed, read-only block of records with its multi-index tables.
+    """
+
+    def __init__(self, rec_path):
+        base = rec_path[:-len(".rec.npy")]
+        self.records = np.load(rec_path, mmap_mode="r")
+        self.keys = np.load(base + ".keys.npy", mmap_mode="r")
+        self.pos = np.load(base + ".pos.npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self.records)
+
+    def candidates(self, query, radius):
+        found = []
+        masks = probe_masks(radius)
+
+        for chunk in range(NUM_CHUNKS):
+            probes = np.unique(chunk_keys(query, chunk) ^ masks)
+            keys = self.keys[chunk]
+            lo = np.searchsorted(keys, probes, side="left")
+            hi = np.searchsorted(keys, probes, side="right")
+            for a, b in zip(lo, hi):
+                if b > a:
+                    found.append(self.pos[chunk, a:b])
+
+        if not found:
+            return np.empty(0, dtype=np.uint32)
+        return np.unique(np.concatenate(found))
+
+    @staticmethod
+    def write(base, records):
+        """
+        Builds the chunk tables and writes the segment.
+        The .rec.npy file is written last: a segment only exists once it is there.
+        """
+        hashes = records["holder"]
+        keys = np.empty((NUM_CHUNKS, len(records)), dtype=np.uint16)
+        pos = np.empty((NUM_CHUNKS, len(records)), dtype=np.uint32)
+
+        for chunk in range(NUM_CHUNKS):
+            ck = chunk_keys(hashes, chunk)
+            order = np.argsort(ck, kind="stable")
+            keys[chunk] = ck[order]
+            pos[chunk] = order
+
+        for suffix, arr in ((".keys.npy", keys), (".pos.npy", pos), (".rec.npy", records)):
+            tmp = base + suffix + ".tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, base + suffix)
+
+
+# ---------------- INDEX ----------------
+
+class SubmissionIndex:
+    """
+    Safe to share between processes (main.py checks, batch runs) and
+    threads: appends, seals and refreshes run under an exclusive lock on
+    LOCK_NAME, and every call first picks up what other writers added.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, segment_size=SEGMENT_SIZE):
+        self.index_dir = index_dir
+        self.segment_size = segment_size
+        os.makedirs(index_dir, exist_ok=True)
+
+        self.journal_path = os.path.join(index_dir, JOURNAL_NAME)
+        self.lock = FileLock(os.path.join(index_dir, LOCK_NAME))
+        self.segments = []
+
+        self._tail = np.empty(segment_size, dtype=RECORD_DTYPE)
+        self._tail_len = 0
+        self._journal_bytes = -1
+
+        with self.lock:
+            self._refresh()
+
+    def __len__(self):
+        return sum(len(s) for s in self.segments) + self._tail_len
+
+    # ---------- journal (call with the lock held) ----------
+
+    def _refresh(self):
+        """
+        Loads segments sealed by other writers and re-reads the journal
+        if it changed since we last saw it.
+        """
+        paths = sorted(glob.glob(os.path.join(self.index_dir, "seg_*.rec.npy")))
+        new_segments = paths[len(self.segments):]
+        for path in new_segments:
+            self.segments.append(Segment(path))
+
+        size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        if new_segments or size != self._journal_bytes:
+            self._load_journal()
+
+    def _load_journal(self):
+        self._tail_len = 0
+        self._journal_bytes = 0
+        if not os.path.exists(self.journal_path):
+            return
+
+        size = os.path.getsize(self.journal_path)
+        whole = size - size % RECORD_DTYPE.itemsize
+        if whole != size:
+            # Torn last write → drop the partial record
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(whole)
+
+        records = np.fromfile(self.journal_path, dtype=RECORD_DTYPE)
+
+        # Crash after sealing but before the journal was cleared: the
+        # journal still starts with the newest segment's records
+        if self.segments:
+            sealed = self.segments[-1].records
+            if len(records) >= len(sealed) and records[:len(sealed)].tobytes() == sealed.tobytes():
+                records = records[len(sealed):]
+                with open(self.journal_path, "wb") as f:
+                    f.write(records.tobytes())
+
+        if len(records) > len(self._tail):
+            self._tail = np.empty(len(records), dtype=RECORD_DTYPE)
+        self._tail[:len(records)] = records
+        self._tail_len = len(records)
+        self._journal_bytes = records.nbytes
+
+        # Crash after the last append but before sealing
+        if self._tail_len >= self.segment_size:
+            self._seal()
+
+    def _seal(self):
+        base = os.path.join(self.index_dir, f"seg_{len(self.segments) + 1:05d}")
+        Segment.write(base, self._tail[:self._tail_len].copy())
+        self.segments.append(Segment(base + ".rec.npy"))
+
+        open(self.journal_path, "wb").close()
+        self._tail_len = 0
+        self._journal_bytes = 0
+
+    # ---------- public API ----------
+
+    def _contains(self, holder, ref):
+        """
+        True if a record with exactly this holder key and ref exists.
+        Call with the lock held, after _refresh().
+        """
+        query = np.array([holder], dtype=np.uint64)
+        for seg in self.segments:
+            cand = seg.candidates(query, 0)
+            if len(cand):
+                found = seg.records[cand]
+                if ((found["holder"] == holder) & (found["ref"] == ref)).any():
+                    return True
+
+        tail = self._tail[:self._tail_len]
+        return bool(((tail["holder"] == holder) & (tail["ref"] == ref)).any())
+
+    def add(self, holder_hex, phash_hex, ref, name="", ts=None):
+        """
+        Records one submission. Adding the same ref with the same holder
+        key again (a replayed batch stage) is a no-op; returns False then.
+        """
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record["holder"] = phash_to_uint64(holder_hex)
+        record["phash"] = phash_to_uint64(phash_hex)
+        record["ts"] = int(ts if ts is not None else time.time())
+        record["ref"] = str(ref).encode("utf-8")[:64]
+        record["name"] = normalize_name(name).encode("utf-8")[:64]
+
+        with self.lock:
+            # The tail must equal the journal before it can be sealed
+            self._refresh()
+            if self._contains(record["holder"][0], record["ref"][0]):
+                return False
+
+            with open(self.journal_path, "ab") as f:
+                f.write(record.tobytes())
+            self._journal_bytes += record.nbytes
+
+            self._tail[self._tail_len] = record[0]
+            self._tail_len += 1
+
+            if self._tail_len >= self.segment_size:
+                self._seal()
+        return True
+
+    def query_records(self, holder_hex, phash_hex=None, max_distance=DEFAULT_MAX_DISTANCE,
+                      page_max_distance=PAGE_MAX_DISTANCE):
+        """
+        All records within max_distance of the holder fingerprint (and,
+        with phash_hex, page_max_distance of the page pHash), closest first.
+        Returns (records, distances) as arrays; nothing is materialised.
+        """
+        query = np.array([phash_to_uint64(holder_hex)], dtype=np.uint64)
+        radius = max_distance // NUM_CHUNKS
+        matches = []
+
+        with self.lock:
+            self._refresh()
+            segments = list(self.segments)
+            tail = self._tail[:self._tail_len].copy()
+
+        for seg in segments:
+            cand = seg.candidates(query, radius)
+            if len(cand):
+                matches.append(seg.records[cand])
+
+        # Unsealed tail: brute force, it is at most one segment long
+        if len(tail):
+            matches.append(tail)
+
+        if not matches:
+            return np.empty(0, dtype=RECORD_DTYPE), np.empty(0, dtype=np.int64)
+
+        records = np.concatenate(matches)
+        distances = np.bitwise_count(records["holder"] ^ query[0]).astype(np.int64)
+        keep = distances <= max_distance
+        if phash_hex is not None:
+            page = phash_to_uint64(phash_hex)
+            keep &= np.bitwise_count(records["phash"] ^ page) <= page_max_distance
+
+        keep = np.flatnonzero(keep)
+        keep = keep[np.argsort(distances[keep], kind="stable")]
+        return records[keep], distances[keep]
+
+    def query(self, holder_hex, phash_hex=None, max_distance=DEFAULT_MAX_DISTANCE,
+              limit=MAX_REPORTED_MATCHES):
+        """
+        The closest `limit` matches as dicts.
+        """
+        records, distances = self.query_records(holder_hex, phash_hex, max_distance)
+        return [
+            {
+                "ref": records["ref"][i].decode("utf-8", "replace"),
+                "name": records["name"][i].decode("utf-8", "replace"),
+                "ts": int(records["ts"][i]),
+                "distance": int(distances[i]),
+            }
+            for i in range(min(limit, len(records)))
+        ]
+
+
+# ---------------- PIPELINE FUNCTION ----------------
+
+_index = None
+
+
+def get_submission_index():
+    global _index
+    if _index is None:
+        _index = SubmissionIndex()
+    return _index
+
+
+def check_submission_reuse(phash_hex, holder_hex, ref, name="",
+                           max_distance=DEFAULT_MAX_DISTANCE, index=None):
+    """
+    Looks up earlier submissions of the same certificate (same template,
+    same holder line, within a few bits), then records this one.
+    Earlier records of the same ref (re-verifying the same file) are
+    ignored, and the same ref is only recorded once.
+    holder_hex: holder_fingerprint() of the page.
+
+    Verdicts:
+        UNCHECKED                    → no holder name line found, not recorded
+        FIRST_SEEN                   → no earlier near-duplicate
+        RESUBMISSION                 → seen before under the same holder name
+        DUPLICATE_NAME_UNKNOWN       → near-duplicate, but a name is missing
+        REUSED_UNDER_DIFFERENT_NAME  → same certificate seen under another name
+    """
+    if holder_hex is None:
+        return {"duplicate_verdict": "UNCHECKED", "duplicate_count": 0}
+
+    index = index or get_submission_index()
+    name = normalize_name(name)
+
+    records, distances = index.query_records(holder_hex, phash_hex, max_distance)
+    other = records["ref"] != str(ref).encode("utf-8")[:64]
+    records, distances = records[other], distances[other]
+
+    names = records["name"]
+    named = names != b""
+    name_bytes = name.encode("utf-8")[:64]
+
+    if not len(records):
+        verdict = "FIRST_SEEN"
+    elif name and (names[named] != name_bytes).any():
+        verdict = "REUSED_UNDER_DIFFERENT_NAME"
+    elif not name or not named.all():
+        verdict = "DUPLICATE_NAME_UNKNOWN"
+    else:
+        verdict = "RESUBMISSION"
+
+    index.add(holder_hex, phash_hex, ref, name)
+
+    result = {
+        "duplicate_verdict": verdict,
+        "duplicate_count": int(len(records)),
+    }
+    if len(records):
+        result["closest_ref"] = records["ref"][0].decode("utf-8", "replace")
+        result["closest_distance"] = int(distances[0])
+
+    return result
@@ -0,0 +1,273 @@
+# utils/downloader.py
+
+"""
+Shared download subsystem for Drive PDFs.
+
+- one keep-alive connection pool (requests.Session) per process
+- (connect, read) timeouts on every request
+- per-host token-bucket rate limiting
+- retry with exponential backoff on connection errors / 429 / 5xx
+  (Retry-After is honoured)
+- 1 MiB streaming buffers
+- interrupted transfers resume from the .part file via a Range request,
+  guarded by If-Range so a changed file is never spliced together
+- batch runs fetch several documents at once on the scheduler's "fetch"
+  pool (utils.scheduler.STAGE_WORKERS), which the connection pool covers
+
+Point DRIVE_DOWNLOAD_URL at scripts/drive_standin_server.py to exercise
+latency and failures locally:
+    EDUVAULT_DRIVE_URL="http://127.0.0.1:8765/uc?export=download&id={file_id}"
+"""
+
+import os
+import time
+import random
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ---------------- CONFIG ----------------
+
+DRIVE_DOWNLOAD_URL = os.environ.get(
+    "EDUVAULT_DRIVE_URL",
+    "https://drive.google.com/uc?export=download&id={file_id}"
+)
+
+# Disk writes are buffered in 1 MiB; the socket is read in smaller
+# pieces so a transfer cut off midway keeps nearly everything it received
+CHUNK_SIZE = 1024 * 1024
+READ_SIZE = 64 * 1024
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+POOL_SIZE = 16
+
+# Per-host token bucket
+HOST_RATE = 5.0      # requests / second
+HOST_BURST = 5
+
+# Consecutive attempts without progress before giving up
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+RETRYABLE_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+def drive_download_url(file_id):
+    return DRIVE_DOWNLOAD_URL.format(file_id=file_id)
+
+
+# ---------------- RATE LIMITING ----------------
+
+class HostRateLimiter:
+    """
+    Token bucket per host, shared by all download threads.
+    """
+
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+                if tokens >= 1:
+                    self._buckets[host] = (tokens - 1, now)
+                    return
+
+                self._buckets[host] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+
+            time.sleep(wait)
+
+
+_rate_limiter = HostRateLimiter()
+
+
+# ---------------- SESSION ----------------
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Process-wide keep-alive session. Retries are handled in
+    download_file, so the adapter itself does not retry.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_SIZE,
+                    pool_maxsize=POOL_SIZE,
+                    max_retries=0
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+# ---------------- DOWNLOAD ----------------
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    delay = min(BACKOFF_BASE * (2 ** attempt), BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _content_range_total(response):
+    # "bytes 100-199/200" or "bytes */200"
+    value = response.headers.get("Content-Range", "")
+    total = value.rsplit("/", 1)[-1]
+    return int(total) if total.isdigit() else None
+
+
+def _validator(response):
+    """
+    If-Range value identifying this version of the file: a strong ETag,
+    else Last-Modified. None when the server sends neither.
+    """
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def _content_range_start(response):
+    # "bytes 100-199/200" → 100
+    value = response.headers.get("Content-Range", "")
+    try:
+        return int(value.split(" ", 1)[1].split("-", 1)[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _read_validator(meta_path):
+    try:
+        with open(meta_path) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_validator(meta_path, validator):
+    with open(meta_path, "w") as f:
+        f.write(validator or "")
+
+
+def _discard(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def download_file(url, out_path, session=None, rate_limiter=None):
+    """
+    Streams url → out_path. Returns out_path.
+
+    Data lands in out_path + ".part" first; a retry (or a later call after
+    a crash) continues from the bytes already on disk. The ETag /
+    Last-Modified of the first response is kept next to it (".part.meta")
+    and sent as If-Range, so a file that changed on the server is fetched
+    again from the start instead of being spliced onto the old bytes.
+
+    MAX_RETRIES counts consecutive attempts that added nothing to the
+    .part file: a slow transfer that keeps getting cut off but makes
+    progress every time is not given up on.
+    """
+    session = session or get_session()
+    rate_limiter = rate_limiter or _rate_limiter
+    host = urlparse(url).netloc
+    part_path = out_path + ".part"
+    meta_path = part_path + ".meta"
+
+    failures = 0
+    last_offset = -1
+
+    while True:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = _read_validator(meta_path)
+        if offset and validator is None:
+            # Nothing to check the old bytes against
+            _discard(part_path)
+            offset = 0
+
+        if offset > last_offset >= 0:
+            failures = 0
+        last_offset = offset
+
+        headers = {}
+        if offset:
+            headers = {"Range": f"bytes={offset}-", "If-Range": validator}
+
+        rate_limiter.acquire(host)
+        try:
+            with session.get(
+                url,
+                stream=True,
+                headers=headers,
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+            ) as r:
+                if r.status_code == 416 and _content_range_total(r) == offset:
+                    # .part already holds the whole file
+                    break
+
+                if r.status_code == 416:
+                    _discard(part_path, meta_path)
+                    last_offset = -1
+                    continue
+
+                if r.status_code in RETRY_STATUS and failures < MAX_RETRIES:
+                    time.sleep(backoff_delay(failures, r.headers.get("Retry-After")))
+                    failures += 1
+                    continue
+
+                r.raise_for_status()
+
+                # 200 → the server ignored the range or the file changed
+                # (If-Range mismatch): start over with the new version
+                resume = offset and r.status_code == 206 and _content_range_start(r) == offset
+                if not resume:
+                    _write_validator(meta_path, _validator(r))
+                    last_offset = 0
+
+                with open(part_path, "ab" if resume else "wb", buffering=CHUNK_SIZE) as f:
+                    for chunk in r.iter_content(READ_SIZE):
+                        f.write(chunk)
+            break
+
+        except RETRYABLE_ERRORS:
+            size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if size > last_offset:
+                # Made progress: resume now, the budget resets above
+                continue
+            if failures >= MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(failures))
+            failures += 1
+
+    _discard(meta_path)
+    os.replace(part_path, out_path)
+    return out_path
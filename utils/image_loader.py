@@ -1,8 +1,9 @@
 import os
-import requests
 from pdf2image import convert_from_path
 from urllib.parse import urlparse, parse_qs
 
+from utils.downloader import download_file, drive_download_url
+
 POPPLER_PATH = r"C:\poppler\Library\bin"
 
 
@@ -18,20 +19,11 @@ def extract_file_id(drive_link):
 
 def download_pdf_temp(drive_link, file_id):
     """Download PDF temporarily (will be deleted after PNG conversion)."""
-    url = f"https://drive.google.com/uc?export=download&id={file_id}"
     temp_pdf = f"temp_{file_id}.pdf"
 
     print(f"⬇ Downloading PDF ({file_id})...")
 
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-
-    with open(temp_pdf, "wb") as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-
-    return temp_pdf
+    return download_file(drive_download_url(file_id), temp_pdf)
 
 
 def pdf_to_images(pdf_path, file_id, output_folder="../utils/output_images"):
@@ -0,0 +1,242 @@
+# utils/ingest_templates.py
+
+"""
+Bulk template ingestion for the issuer pHash database.
+
+Expected layout (one folder per issuer, folder name = issuer prefix):
+
+    templates/
+        unstop/
+            hackathon.pdf
+            quiz.png
+        nptel/
+            ...
+
+Every template is fingerprinted in parallel, near-identical templates
+are dropped (against the DB and against each other) and the survivors
+are written as <issuer>_tN rows in ONE transaction.
+Re-running on the same folder inserts nothing.
+
+Usage:
+    python -m utils.ingest_templates templates/
+"""
+
+import os
+import re
+import sys
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+import imagehash
+from PIL import Image
+
+from stages.phash import DB_PATH
+
+# ---------------- CONFIG ----------------
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+PDF_EXTENSIONS = (".pdf",)
+
+# pHash works on a 32x32 downscale, so a low render DPI gives the
+# same fingerprint as the 300 DPI pipeline render at a fraction of the cost
+PDF_RENDER_DPI = 100
+
+# Templates closer than this (in bits) are treated as the same template
+DEDUPE_DISTANCE = 4
+
+# Files handed to each worker process per task
+CHUNK_SIZE = 16
+
+
+# ---------------- FILE DISCOVERY ----------------
+
+def discover_templates(root_dir):
+    """
+    Returns [(issuer_id, file_path), ...] for every template under root_dir.
+    The first-level folder name is the issuer id.
+    """
+    templates = []
+
+    for issuer_id in sorted(os.listdir(root_dir)):
+        issuer_dir = os.path.join(root_dir, issuer_id)
+        if not os.path.isdir(issuer_dir):
+            continue
+
+        for dirpath, _, filenames in os.walk(issuer_dir):
+            for fname in sorted(filenames):
+                if fname.lower().endswith(IMAGE_EXTENSIONS + PDF_EXTENSIONS):
+                    templates.append((issuer_id.lower(), os.path.join(dirpath, fname)))
+
+    return templates
+
+
+# ---------------- FINGERPRINTING (worker side) ----------------
+
+def load_template_image(path):
+    """
+    Image → PIL image, PDF → first page rendered as PIL image
+    (the pipeline only verifies the first page).
+    """
+    if path.lower().endswith(PDF_EXTENSIONS):
+        doc = fitz.open(path)
+        try:
+            pix = doc[0].get_pixmap(dpi=PDF_RENDER_DPI)
+            return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        finally:
+            doc.close()
+
+    return Image.open(path).convert("RGB")
+
+
+def fingerprint_template(item):
+    """
+    (issuer_id, path) → (issuer_id, path, phash_hex or None, error or None)
+    """
+    issuer_id, path = item
+    try:
+        image = load_template_image(path)
+        return issuer_id, path, str(imagehash.phash(image)), None
+    except Exception as e:
+        return issuer_id, path, None, str(e)
+
+
+def fingerprint_all(templates, workers=None):
+    if not templates:
+        return []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fingerprint_template, templates, chunksize=CHUNK_SIZE))
+
+
+# ---------------- DEDUPE ----------------
+
+def phash_to_int(phash_hex):
+    return int(phash_hex, 16)
+
+
+def is_near_duplicate(value, known_values, max_distance=DEDUPE_DISTANCE):
+    """
+    Hamming distance on 64-bit ints (XOR + popcount),
+    same metric as imagehash's `hash1 - hash2`.
+    """
+    for known in known_values:
+        if (value ^ known).bit_count() <= max_distance:
+            return True
+    return False
+
+
+# ---------------- DB HELPERS ----------------
+
+def ensure_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS issuer_phash (
+            issuer_id TEXT PRIMARY KEY,
+            issuer_name TEXT,
+            phash TEXT NOT NULL
+        )
+    """)
+
+
+def load_existing(conn):
+    """
+    Returns {issuer_prefix: {"hashes": [...], "next_t": int, "name": str}}
+    for every issuer already in the DB.
+    """
+    existing = {}
+    pattern = re.compile(r"^(.*?)(?:_t(\d+))?$")
+
+    for issuer_id, issuer_name, phash in conn.execute(
+        "SELECT issuer_id, issuer_name, phash FROM issuer_phash"
+    ):
+        prefix, t_num = pattern.match(issuer_id).groups()
+        entry = existing.setdefault(prefix, {"hashes": [], "next_t": 1, "name": issuer_name})
+        entry["hashes"].append(phash_to_int(phash))
+        if t_num is not None:
+            entry["next_t"] = max(entry["next_t"], int(t_num) + 1)
+
+    return existing
+
+
+def plan_inserts(fingerprints, existing, max_distance=DEDUPE_DISTANCE):
+    """
+    Decides which fingerprints become new <issuer>_tN rows.
+    Returns (rows, skipped, failed).
+    """
+    rows = []
+    skipped = []
+    failed = []
+
+    for issuer_id, path, phash, error in fingerprints:
+        if phash is None:
+            failed.append((path, error))
+            continue
+
+        entry = existing.setdefault(issuer_id, {
+            "hashes": [],
+            "next_t": 1,
+            "name": issuer_id.replace("_", " ").title()
+        })
+
+        value = phash_to_int(phash)
+        if is_near_duplicate(value, entry["hashes"], max_distance):
+            skipped.append(path)
+            continue
+
+        template_id = f"{issuer_id}_t{entry['next_t']}"
+        entry["next_t"] += 1
+        entry["hashes"].append(value)
+        rows.append((template_id, entry["name"], phash))
+
+    return rows, skipped, failed
+
+
+# ---------------- PIPELINE ENTRY ----------------
+
+def ingest_templates(root_dir, db_path=DB_PATH, workers=None):
+    templates = discover_templates(root_dir)
+    print(f"📂 Found {len(templates)} template files")
+
+    fingerprints = fingerprint_all(templates, workers)
+
+    # Autocommit mode: the transaction below is managed explicitly
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        ensure_table(conn)
+
+        # Read, plan and write under one write lock, so a concurrent ingest
+        # or baseline insert cannot claim the same <issuer>_tN in between.
+        # Plain INSERT: a collision fails instead of replacing a template.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows, skipped, failed = plan_inserts(fingerprints, load_existing(conn))
+            conn.executemany("""
+                INSERT INTO issuer_phash (issuer_id, issuer_name, phash)
+                VALUES (?, ?, ?)
+            """, rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    return {
+        "discovered": len(templates),
+        "inserted": len(rows),
+        "skipped_duplicates": len(skipped),
+        "failed": failed
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m utils.ingest_templates <templates_dir>")
+        sys.exit(1)
+
+    summary = ingest_templates(sys.argv[1])
+
+    print(f"✅ Inserted {summary['inserted']} templates")
+    print(f"♻ Skipped {summary['skipped_duplicates']} near-duplicates")
+    for path, error in summary["failed"]:
+        print(f"❌ {path}: {error}")
@@ -0,0 +1,181 @@
+# utils/job_store.py
+
+"""
+SQLite-backed checkpoint store for batch verification runs.
+
+One row per submission: the last finished stage, the accumulated stage
+outputs (zlib-compressed JSON) and the error if a stage failed.
+Checkpoints are buffered and written with executemany in one
+transaction every COMMIT_EVERY updates / COMMIT_INTERVAL seconds, so a
+crash loses at most that window of progress, never a finished batch.
+Stages in that window run again on resume, so writes they make outside
+the store must be idempotent (keyed on the document).
+"""
+
+import json
+import time
+import zlib
+import sqlite3
+
+import numpy as np
+
+# ---------------- CONFIG ----------------
+
+JOB_DB_PATH = "data/jobs.db"
+
+STAGES = ["fetched", "rendered", "ocr", "hashed", "scored", "aggregated"]
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+COMMIT_EVERY = 500
+COMMIT_INTERVAL = 2.0  # seconds
+
+
+# ---------------- ENCODING ----------------
+
+def _json_default(value):
+    # EasyOCR / NumPy results carry numpy scalars and arrays
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+def encode_outputs(outputs):
+    raw = json.dumps(outputs, separators=(",", ":"), default=_json_default)
+    return zlib.compress(raw.encode("utf-8"))
+
+
+def decode_outputs(blob):
+    if not blob:
+        return {}
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+# ---------------- STORE ----------------
+
+class JobStore:
+
+    def __init__(self, db_path=JOB_DB_PATH):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                doc_id TEXT PRIMARY KEY,
+                link TEXT NOT NULL,
+                stage TEXT,
+                status TEXT NOT NULL,
+                outputs BLOB,
+                error TEXT,
+                updated_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self.conn.commit()
+
+        # doc_id → (stage, status, outputs_blob, error, updated_at)
+        self._pending = {}
+        self._last_commit = time.monotonic()
+
+    # ---------- batch setup ----------
+
+    def add_jobs(self, jobs):
+        """
+        jobs: [(doc_id, link), ...]. Already known doc_ids are left untouched,
+        so re-adding the same batch after a crash is safe.
+        """
+        with self.conn:
+            self.conn.executemany("""
+                INSERT OR IGNORE INTO jobs (doc_id, link, stage, status, updated_at)
+                VALUES (?, ?, NULL, ?, ?)
+            """, [(doc_id, link, STATUS_PENDING, time.time()) for doc_id, link in jobs])
+
+    def unfinished_jobs(self, retry_failed=False):
+        """
+        Returns [(doc_id, link), ...] that still have stages to run.
+        """
+        self.flush()
+        statuses = (STATUS_PENDING, STATUS_FAILED) if retry_failed else (STATUS_PENDING,)
+        marks = ",".join("?" * len(statuses))
+        return self.conn.execute(
+            f"SELECT doc_id, link FROM jobs WHERE status IN ({marks}) ORDER BY rowid",
+            statuses
+        ).fetchall()
+
+    def done_jobs(self):
+        """
+        Returns [(doc_id, updated_at), ...] of finished documents.
+        """
+        self.flush()
+        return self.conn.execute(
+            "SELECT doc_id, updated_at FROM jobs WHERE status = ? ORDER BY rowid",
+            (STATUS_DONE,)
+        ).fetchall()
+
+    # ---------- checkpoints ----------
+
+    def load(self, doc_id):
+        """
+        Returns (last_finished_stage or None, outputs dict).
+        """
+        if doc_id in self._pending:
+            stage, _, blob, _, _ = self._pending[doc_id]
+            return stage, decode_outputs(blob)
+
+        row = self.conn.execute(
+            "SELECT stage, outputs FROM jobs WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], decode_outputs(row[1])
+
+    def checkpoint(self, doc_id, stage, outputs, sync=False):
+        """
+        sync=True commits right away (with everything buffered so far).
+        """
+        status = STATUS_DONE if stage == STAGES[-1] else STATUS_PENDING
+        self._buffer(doc_id, stage, status, encode_outputs(outputs), None)
+        if sync:
+            self.flush()
+
+    def mark_failed(self, doc_id, stage, outputs, error):
+        """
+        stage = last stage that DID finish; the next run resumes after it.
+        """
+        self._buffer(doc_id, stage, STATUS_FAILED, encode_outputs(outputs), str(error))
+
+    def _buffer(self, doc_id, stage, status, blob, error):
+        self._pending[doc_id] = (stage, status, blob, error, time.time())
+
+        if (
+            len(self._pending) >= COMMIT_EVERY
+            or time.monotonic() - self._last_commit >= COMMIT_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with self.conn:
+                self.conn.executemany("""
+                    UPDATE jobs
+                    SET stage = ?, status = ?, outputs = ?, error = ?, updated_at = ?
+                    WHERE doc_id = ?
+                """, [(*row, doc_id) for doc_id, row in self._pending.items()])
+            self._pending.clear()
+        self._last_commit = time.monotonic()
+
+    # ---------- reporting ----------
+
+    def summary(self):
+        self.flush()
+        return dict(self.conn.execute(
+            "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+        ).fetchall())
+
+    def close(self):
+        self.flush()
+        self.conn.close()
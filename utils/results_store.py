@@ -0,0 +1,529 @@
+# utils/results_store.py
+
+"""
+Columnar store for verification results.
+
+Rows are packed NumPy records (fixed-width, categorical columns
+dictionary-encoded), partitioned by UTC day:
+
+    data/results/
+        date=2026-10-19/part-....npy           → one file per writer flush
+        date=2026-10-19/part-....labels.json   → code → label for that part
+
+ResultsWriter buffers rows and writes a part file every FLUSH_ROWS rows
+(or on flush/close). ResultsStore memory-maps only the partitions inside
+the requested date range and filters them with vectorised masks.
+
+Every part carries its own label dictionary (started afresh for each
+flush), so several writers (batch runs, single checks) can append at the
+same time; the reader maps each part's codes into one code space.
+Issuer ids are stored as a family label plus a number ("unknown_17" →
+issuer "unknown", issuer_seq 17), so the issuer dictionary stays small
+however many unknown issuers are created.
+
+Single checks write one tiny part each. Once a day holds more than
+COMPACT_PARTS small parts, the writer merges those into one
+(compact_partition); parts that are already large are left alone. The
+merged part lists the parts it replaces in part-....supersedes.json, so
+readers skip them until they are deleted.
+"""
+
+import os
+import re
+import json
+import glob
+import time
+import uuid
+import threading
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+# ---------------- CONFIG ----------------
+
+RESULTS_DIR = "data/results"
+LABELS_SUFFIX = ".labels.json"
+SUPERSEDES_SUFFIX = ".supersedes.json"
+FLUSH_ROWS = 10000
+
+# Compaction: merge a day's small parts once there are more than this
+COMPACT_PARTS = 32
+SMALL_PART_ROWS = FLUSH_ROWS
+COMPACT_LOCK_NAME = ".compact.lock"
+COMPACT_LOCK_STALE_S = 600   # lock left behind by a crashed compaction
+
+CATEGORICAL = [
+    "issuer",
+    "final_verdict",
+    "pdf_verdict",
+    "phash_verdict",
+    "cnn_verdict",
+    "duplicate_verdict",
+]
+
+RESULT_DTYPE = np.dtype([
+    ("ts", "<i8"),                 # epoch seconds, UTC
+    ("doc_ref", "S64"),
+    ("issuer", "<u2"),             # issuer family, see split_issuer
+    ("issuer_seq", "<u4"),         # N of unknown_N, else 0
+    ("final_verdict", "u1"),
+    ("trust_score", "<f4"),
+    ("pdf_verdict", "u1"),
+    ("forensic_score", "<i2"),
+    ("phash_verdict", "u1"),
+    ("hamming_distance", "<i2"),   # -1 = no baseline to compare against
+    ("cnn_score", "<f4"),
+    ("cnn_verdict", "u1"),
+    ("duplicate_verdict", "u1"),
+])
+
+
+SMALL_PART_BYTES = SMALL_PART_ROWS * RESULT_DTYPE.itemsize
+
+NUMBERED_ISSUER = re.compile(r"^(unknown)_(\d+)$")
+
+
+def split_issuer(issuer_id):
+    """
+    "unknown_17" → ("unknown", 17); any other id → (id, 0).
+    """
+    match = NUMBERED_ISSUER.match(issuer_id or "")
+    if match:
+        return match.group(1), int(match.group(2))
+    return issuer_id or "", 0
+
+
+def join_issuer(family, seq):
+    return f"{family}_{seq}" if seq else family
+
+
+def _day(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return datetime.fromtimestamp(value, timezone.utc).date().isoformat()
+
+
+# ---------------- DICTIONARIES ----------------
+
+def labels_path(part_path):
+    return part_path[:-len(".npy")] + LABELS_SUFFIX
+
+
+def supersedes_path(part_path):
+    return part_path[:-len(".npy")] + SUPERSEDES_SUFFIX
+
+
+def _new_part_name():
+    return f"part-{int(time.time() * 1000)}-{uuid.uuid4().hex[:12]}.npy"
+
+
+class Dictionaries:
+    """
+    Append-only label ↔ code mapping per categorical column.
+    Code 0 is always "" (missing).
+    """
+
+    def __init__(self, labels=None):
+        self.labels = {col: [""] for col in CATEGORICAL}
+        self.labels.update(labels or {})
+        self.codes = {
+            col: {label: i for i, label in enumerate(labels)}
+            for col, labels in self.labels.items()
+        }
+
+    @classmethod
+    def for_part(cls, part_path):
+        with open(labels_path(part_path)) as f:
+            return cls(json.load(f))
+
+    def encode(self, column, label):
+        label = label or ""
+        codes = self.codes[column]
+        if label not in codes:
+            code = len(self.labels[column])
+            if code > np.iinfo(RESULT_DTYPE[column]).max:
+                raise OverflowError(f"Too many distinct {column} labels ({code})")
+            codes[label] = code
+            self.labels[column].append(label)
+        return codes[label]
+
+    def lookup(self, column, label):
+        """Code for an existing label, or None."""
+        return self.codes[column].get(label)
+
+    def decode(self, column, codes):
+        return np.asarray(self.labels[column], dtype=object)[np.asarray(codes)]
+
+    def remap(self, other):
+        """
+        Per column, an array mapping other's codes to codes in self
+        (labels missing from self are added).
+        """
+        return {
+            col: np.array([self.encode(col, label) for label in other.labels[col]], dtype=RESULT_DTYPE[col])
+            for col in CATEGORICAL
+        }
+
+    def save_for(self, part_path):
+        path = labels_path(part_path)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.labels, f)
+        os.replace(tmp, path)
+
+
+def write_part(part_dir, name, records, dictionaries):
+    """
+    Labels first, then the records: a part only exists once its .npy is there.
+    """
+    path = os.path.join(part_dir, name)
+    dictionaries.save_for(path)
+
+    tmp = os.path.join(part_dir, "." + name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, records)
+    os.replace(tmp, path)
+    return path
+
+
+# ---------------- WRITER ----------------
+
+class ResultsWriter:
+
+    def __init__(self, root=RESULTS_DIR, flush_rows=FLUSH_ROWS):
+        self.root = root
+        self.flush_rows = flush_rows
+        os.makedirs(root, exist_ok=True)
+
+        self.dictionaries = Dictionaries()
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, pdf_result, phash_result, cnn_result, final_result,
+               duplicate_result=None, doc_ref="", ts=None):
+        """
+        Takes the stage result dicts exactly as the pipeline produces them.
+        A row that cannot be encoded raises here and is not buffered.
+        """
+        duplicate_result = duplicate_result or {}
+        issuer, issuer_seq = split_issuer(phash_result.get("issuer_id"))
+
+        with self._lock:
+            d = self.dictionaries
+            row = np.array([(
+                int(ts if ts is not None else time.time()),
+                str(doc_ref).encode("utf-8")[:64],
+                d.encode("issuer", issuer),
+                issuer_seq,
+                d.encode("final_verdict", final_result.get("final_verdict")),
+                final_result.get("trust_score", 0.0),
+                d.encode("pdf_verdict", pdf_result.get("verdict")),
+                pdf_result.get("forensic_score", 0),
+                d.encode("phash_verdict", phash_result.get("phash_verdict")),
+                phash_result.get("hamming_distance", -1),
+                cnn_result.get("cnn_anomaly_score", 0.0),
+                d.encode("cnn_verdict", cnn_result.get("cnn_anomaly_verdict")),
+                d.encode("duplicate_verdict", duplicate_result.get("duplicate_verdict")),
+            )], dtype=RESULT_DTYPE)
+            self._rows.append(row)
+            if len(self._rows) >= self.flush_rows:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._rows:
+            return
+
+        records = np.concatenate(self._rows)
+        dictionaries = self.dictionaries
+        self._rows = []
+        self.dictionaries = Dictionaries()
+
+        days = np.array([_day(int(t)) for t in records["ts"]])
+        for day in np.unique(days):
+            part_dir = os.path.join(self.root, f"date={day}")
+            os.makedirs(part_dir, exist_ok=True)
+
+            write_part(part_dir, _new_part_name(), records[days == day], dictionaries)
+
+            if len(small_parts(part_dir)) > COMPACT_PARTS:
+                try:
+                    compact_partition(part_dir)
+                except Exception as e:
+                    print(f"⚠ Results compaction failed for {part_dir}: {e}")
+
+    def close(self):
+        self.flush()
+
+
+# ---------------- COMPACTION ----------------
+
+def live_parts(part_dir):
+    """
+    Part files of one day, minus those already merged into a compacted part.
+    """
+    parts = sorted(glob.glob(os.path.join(part_dir, "part-*.npy")))
+    superseded = set()
+    for path in parts:
+        try:
+            with open(supersedes_path(path)) as f:
+                superseded.update(os.path.join(part_dir, name) for name in json.load(f))
+        except FileNotFoundError:
+            pass
+    return [p for p in parts if p not in superseded]
+
+
+def small_parts(part_dir):
+    """
+    Live parts below SMALL_PART_ROWS rows (single checks, short flushes).
+    """
+    small = []
+    for path in live_parts(part_dir):
+        try:
+            if os.path.getsize(path) < SMALL_PART_BYTES:
+                small.append(path)
+        except FileNotFoundError:
+            pass
+    return small
+
+
+def _acquire_lock(path):
+    for _ in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) < COMPACT_LOCK_STALE_S:
+                    return False
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return False
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def compact_partition(part_dir, small_only=True):
+    """
+    Merges the small live parts of one day (all of them with
+    small_only=False) into a single part.
+    Returns its path, or None when there was nothing to do or another
+    process is compacting the same day.
+    """
+    lock = os.path.join(part_dir, COMPACT_LOCK_NAME)
+    if not _acquire_lock(lock):
+        return None
+
+    try:
+        parts = small_parts(part_dir) if small_only else live_parts(part_dir)
+        if len(parts) < 2:
+            return None
+
+        merged = Dictionaries()
+        chunks = []
+        for path in parts:
+            rows = np.load(path)
+            remap = merged.remap(Dictionaries.for_part(path))
+            for col in CATEGORICAL:
+                rows[col] = remap[col][rows[col]]
+            chunks.append(rows)
+
+        name = _new_part_name()
+        out_path = os.path.join(part_dir, name)
+
+        # Readers skip the old parts as soon as the merged one exists
+        tmp = supersedes_path(out_path) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump([os.path.basename(p) for p in parts], f)
+        os.replace(tmp, supersedes_path(out_path))
+
+        write_part(part_dir, name, np.concatenate(chunks), merged)
+
+        for path in parts:
+            _remove(path)
+            _remove(labels_path(path))
+            _remove(supersedes_path(path))
+        _remove(supersedes_path(out_path))
+
+        return out_path
+    finally:
+        _remove(lock)
+
+
+# ---------------- QUERY ----------------
+
+class ResultsStore:
+
+    def __init__(self, root=RESULTS_DIR):
+        self.root = root
+        # Store-wide code space; part files are remapped into it on read
+        self.dictionaries = Dictionaries()
+        self._remaps = {}
+
+    def partitions(self, start=None, end=None):
+        """
+        Part files whose day lies in [start, end] (inclusive, YYYY-MM-DD).
+        """
+        start, end = _day(start), _day(end)
+        paths = []
+        for part_dir in sorted(glob.glob(os.path.join(self.root, "date=*"))):
+            day = os.path.basename(part_dir)[len("date="):]
+            if (start is None or day >= start) and (end is None or day <= end):
+                paths.extend(live_parts(part_dir))
+        return paths
+
+    def compact(self, start=None, end=None):
+        """
+        Merges all part files of every day in [start, end] into one per
+        day. Returns the number of days compacted.
+        """
+        start, end = _day(start), _day(end)
+        done = 0
+        for part_dir in sorted(glob.glob(os.path.join(self.root, "date=*"))):
+            day = os.path.basename(part_dir)[len("date="):]
+            if (start is None or day >= start) and (end is None or day <= end):
+                done += compact_partition(part_dir, small_only=False) is not None
+        return done
+
+    def doc_refs(self, start=None, end=None):
+        """
+        Sorted unique doc_ref values (bytes) stored for [start, end].
+        """
+        for _ in range(3):
+            try:
+                return self._doc_refs(start, end)
+            except FileNotFoundError:
+                continue
+        return self._doc_refs(start, end)
+
+    def _doc_refs(self, start, end):
+        refs = [np.load(p, mmap_mode="r")["doc_ref"] for p in self.partitions(start, end)]
+        if not refs:
+            return np.empty(0, dtype=RESULT_DTYPE["doc_ref"])
+        return np.unique(np.concatenate(refs))
+
+    def _remap(self, path):
+        # Part files are immutable, so their remap tables are cached
+        if path not in self._remaps:
+            part = Dictionaries.for_part(path)
+            self._remaps[path] = (part, self.dictionaries.remap(part))
+        return self._remaps[path]
+
+    @staticmethod
+    def _issuer_mask(dictionaries, rows, issuers):
+        """
+        "unknown" matches every unknown_N, "unknown_17" only that one.
+        """
+        if isinstance(issuers, str):
+            issuers = [issuers]
+        mask = np.zeros(len(rows), dtype=bool)
+        for issuer in issuers:
+            family, seq = split_issuer(issuer)
+            code = dictionaries.lookup("issuer", family)
+            if code is None:
+                continue
+            match = rows["issuer"] == code
+            if seq:
+                match &= rows["issuer_seq"] == seq
+            mask |= match
+        return mask
+
+    @staticmethod
+    def _codes(dictionaries, column, labels):
+        if labels is None:
+            return None
+        if isinstance(labels, str):
+            labels = [labels]
+        codes = [dictionaries.lookup(column, label) for label in labels]
+        return np.array([c for c in codes if c is not None], dtype=RESULT_DTYPE[column])
+
+    def query(self, issuer=None, verdict=None, start=None, end=None):
+        """
+        Returns the matching rows as one structured array (codes, not
+        labels; decode with decode() / to_dicts() of this store).
+        issuer / verdict: a label or list of labels ("unknown" matches
+        every unknown_N issuer).
+        start / end: date, datetime, epoch seconds or "YYYY-MM-DD"; inclusive days.
+        """
+        # A concurrent compaction can delete a listed part: list again
+        for _ in range(3):
+            try:
+                return self._query(issuer, verdict, start, end)
+            except FileNotFoundError:
+                continue
+        return self._query(issuer, verdict, start, end)
+
+    def _query(self, issuer, verdict, start, end):
+        paths = self.partitions(start, end)
+        self._remaps = {p: self._remaps[p] for p in paths if p in self._remaps}
+
+        chunks = []
+        for path in paths:
+            part, remap = self._remap(path)
+            rows = np.load(path, mmap_mode="r")
+            mask = np.ones(len(rows), dtype=bool)
+
+            # Filter on the part's own codes, remap only what is kept
+            verdict_codes = self._codes(part, "final_verdict", verdict)
+            if issuer is not None:
+                mask &= self._issuer_mask(part, rows, issuer)
+            if verdict_codes is not None:
+                mask &= np.isin(rows["final_verdict"], verdict_codes)
+
+            if mask.all():
+                selected = np.array(rows)
+            elif mask.any():
+                selected = rows[mask]
+            else:
+                continue
+
+            for col in CATEGORICAL:
+                selected[col] = remap[col][selected[col]]
+            chunks.append(selected)
+
+        if not chunks:
+            return np.empty(0, dtype=RESULT_DTYPE)
+        return np.concatenate(chunks)
+
+    def count(self, **filters):
+        return len(self.query(**filters))
+
+    def decode(self, rows, column):
+        """Labels for a categorical column of query() output."""
+        labels = self.dictionaries.decode(column, rows[column])
+        if column == "issuer":
+            labels = np.array(
+                [join_issuer(f, s) for f, s in zip(labels, rows["issuer_seq"].tolist())],
+                dtype=object
+            )
+        return labels
+
+    def to_dicts(self, rows):
+        out = []
+        for row in rows:
+            item = {name: row[name].item() for name in RESULT_DTYPE.names}
+            item["doc_ref"] = row["doc_ref"].decode("utf-8", "replace")
+            for col in CATEGORICAL:
+                item[col] = self.dictionaries.labels[col][row[col]]
+            item["issuer"] = join_issuer(item["issuer"], item["issuer_seq"])
+            out.append(item)
+        return out
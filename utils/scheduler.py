@@ -0,0 +1,347 @@
+# utils/scheduler.py
+
+"""
+Deadline- and priority-aware scheduler for the CPU-heavy pipeline stages.
+
+- One worker pool per stage, sized to the stage's cost (STAGE_WORKERS).
+- Two priority classes: INTERACTIVE (single-certificate checks) and BULK
+  (audits / batch_main). Within a class, earliest deadline first.
+- Admission control: while interactive work is queued or running and
+  its p95 latency is above INTERACTIVE_P95_TARGET, new bulk work is
+  parked and only released once it recovers. With no interactive work
+  in flight, bulk work is always admitted.
+- Interactive tasks whose deadline already passed when a worker picks
+  them up fail with DeadlineExceeded instead of burning CPU. A request
+  spanning several stages passes one absolute `deadline` to all of them.
+- stats() reports queue depth, deferred count and wait / latency stats.
+
+Priorities only arbitrate work inside one process: service.py hosts
+interactive checks and batch runs on the process-wide instance from
+get_scheduler().
+
+Usage:
+    scheduler = get_scheduler()
+    fut = scheduler.submit("ocr", extract_text, image_path,
+                           priority=INTERACTIVE, deadline_s=5)
+    ocr_out = fut.result()
+"""
+
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+# ---------------- CONFIG ----------------
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Workers per stage: CPU-heavy stages get few workers each (they are
+# internally multithreaded); I/O-bound fetch gets more
+STAGE_WORKERS = {
+    "fetch": 8,
+    "render": 2,
+    "ocr": 2,
+    "phash": 2,
+    "cnn": 1,
+    "aggregate": 1,
+}
+DEFAULT_STAGE_WORKERS = 1
+
+DEFAULT_DEADLINE_S = {INTERACTIVE: 10.0, BULK: None}
+
+# Admission control
+INTERACTIVE_P95_TARGET = 8.0   # seconds, end-to-end per stage task
+LATENCY_WINDOW = 200           # recent interactive tasks considered
+LATENCY_HORIZON_S = 60.0       # ...as long as they finished this recently
+ADMISSION_POLL_S = 1.0         # re-check parked bulk work this often
+
+STATS_WINDOW = 1000
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+# ---------------- TASK ----------------
+
+class _Task:
+    __slots__ = ("fn", "args", "kwargs", "priority", "deadline", "submitted", "future")
+
+    def __init__(self, fn, args, kwargs, priority, deadline):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.deadline = deadline
+        self.submitted = time.monotonic()
+        self.future = Future()
+
+    def sort_key(self):
+        # Class first, then earliest deadline (no deadline = last)
+        return (self.priority, self.deadline if self.deadline is not None else float("inf"))
+
+
+# ---------------- STAGE QUEUE ----------------
+
+class _StageQueue:
+    """
+    Priority queue + worker threads for one stage.
+    """
+
+    def __init__(self, name, workers, scheduler):
+        self.name = name
+        self.scheduler = scheduler
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.waits = {p: deque(maxlen=STATS_WINDOW) for p in PRIORITY_NAMES}
+        self.completed = {p: 0 for p in PRIORITY_NAMES}
+        self.expired = 0
+
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"{name}-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def put(self, task):
+        with self._cond:
+            heapq.heappush(self._heap, (task.sort_key(), next(self._seq), task))
+            self._cond.notify()
+
+    def depth(self):
+        with self._cond:
+            counts = {p: 0 for p in PRIORITY_NAMES}
+            for _, _, task in self._heap:
+                counts[task.priority] += 1
+            return counts
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if not self._heap:
+                    return
+                _, _, task = heapq.heappop(self._heap)
+
+            self._run(task)
+
+    def _run(self, task):
+        if not task.future.set_running_or_notify_cancel():
+            self.scheduler._task_done(task, None)
+            return
+
+        started = time.monotonic()
+        self.waits[task.priority].append(started - task.submitted)
+
+        if task.priority == INTERACTIVE and task.deadline is not None and started > task.deadline:
+            self.expired += 1
+            task.future.set_exception(DeadlineExceeded(
+                f"{self.name}: deadline passed {started - task.deadline:.2f}s before start"
+            ))
+            self.scheduler._task_done(task, started)
+            return
+
+        try:
+            result = task.fn(*task.args, **task.kwargs)
+        except BaseException as e:
+            task.future.set_exception(e)
+        else:
+            task.future.set_result(result)
+        finally:
+            self.completed[task.priority] += 1
+            self.scheduler._task_done(task, time.monotonic())
+
+
+# ---------------- SCHEDULER ----------------
+
+class StageScheduler:
+
+    def __init__(self, stage_workers=None, p95_target=INTERACTIVE_P95_TARGET):
+        self.stage_workers = {**STAGE_WORKERS, **(stage_workers or {})}
+        self.p95_target = p95_target
+
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._interactive_latency = deque(maxlen=LATENCY_WINDOW)  # (finished, latency)
+        self._interactive_active = 0   # submitted, not finished
+        self._deferred = deque()
+        self._deferred_total = 0
+
+        # Parked bulk work must drain even when no interactive task
+        # completes to trigger a re-check
+        self._stopping = threading.Event()
+        self._admission_thread = threading.Thread(
+            target=self._admission_loop, name="scheduler-admission", daemon=True
+        )
+        self._admission_thread.start()
+
+    def _stage(self, name):
+        with self._lock:
+            if name not in self._stages:
+                workers = self.stage_workers.get(name, DEFAULT_STAGE_WORKERS)
+                self._stages[name] = _StageQueue(name, workers, self)
+            return self._stages[name]
+
+    # ---------- admission control ----------
+
+    def interactive_p95(self):
+        cutoff = time.monotonic() - LATENCY_HORIZON_S
+        with self._lock:
+            recent = [lat for finished, lat in self._interactive_latency if finished >= cutoff]
+        return percentile(recent, 95)
+
+    def overloaded(self):
+        # Past latency alone must not hold bulk work back on an idle system
+        with self._lock:
+            if self._interactive_active == 0:
+                return False
+        return self.interactive_p95() > self.p95_target
+
+    def _task_done(self, task, finished):
+        """
+        finished=None: the task was cancelled before it ran.
+        """
+        if task.priority == INTERACTIVE:
+            with self._lock:
+                self._interactive_active -= 1
+                if finished is not None:
+                    self._interactive_latency.append((finished, finished - task.submitted))
+        self._release_deferred()
+
+    def _admission_loop(self):
+        while not self._stopping.wait(ADMISSION_POLL_S):
+            self._release_deferred()
+
+    def _release_deferred(self):
+        while self._deferred and not self.overloaded():
+            with self._lock:
+                if not self._deferred:
+                    return
+                stage, task = self._deferred.popleft()
+            self._stage(stage).put(task)
+
+    # ---------- public API ----------
+
+    def submit(self, stage, fn, *args, priority=BULK, deadline_s=None, deadline=None, **kwargs):
+        """
+        Queue fn(*args, **kwargs) on `stage`. Returns a Future.
+        deadline_s: seconds from now (defaults per class, see DEFAULT_DEADLINE_S).
+        deadline: absolute time.monotonic() value instead, so the stages of
+        one request share a single deadline.
+        """
+        if deadline is None:
+            if deadline_s is None:
+                deadline_s = DEFAULT_DEADLINE_S.get(priority)
+            deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+        task = _Task(fn, args, kwargs, priority, deadline)
+
+        if priority == INTERACTIVE:
+            with self._lock:
+                self._interactive_active += 1
+
+        if priority == BULK and self.overloaded():
+            with self._lock:
+                self._deferred.append((stage, task))
+                self._deferred_total += 1
+        else:
+            self._stage(stage).put(task)
+
+        return task.future
+
+    def run(self, stage, fn, *args, priority=BULK, deadline_s=None, deadline=None, **kwargs):
+        """Blocking submit."""
+        return self.submit(
+            stage, fn, *args, priority=priority, deadline_s=deadline_s, deadline=deadline, **kwargs
+        ).result()
+
+    def stats(self):
+        with self._lock:
+            stages = dict(self._stages)
+            deferred = len(self._deferred)
+            deferred_total = self._deferred_total
+            interactive_active = self._interactive_active
+
+        out = {
+            "interactive_active": interactive_active,
+            "interactive_p95_s": round(self.interactive_p95(), 4),
+            "bulk_admission": "deferring" if self.overloaded() else "open",
+            "deferred_bulk": deferred,
+            "deferred_bulk_total": deferred_total,
+            "stages": {}
+        }
+
+        for name, q in stages.items():
+            depth = q.depth()
+            out["stages"][name] = {
+                "workers": len(q.threads),
+                "expired": q.expired,
+                **{
+                    PRIORITY_NAMES[p]: {
+                        "queued": depth[p],
+                        "completed": q.completed[p],
+                        "wait_avg_s": round(sum(q.waits[p]) / len(q.waits[p]), 4) if q.waits[p] else 0.0,
+                        "wait_p95_s": round(percentile(list(q.waits[p]), 95), 4),
+                    }
+                    for p in PRIORITY_NAMES
+                }
+            }
+        return out
+
+    def shutdown(self):
+        """
+        Stops after queued work finishes. Bulk work still parked by
+        admission control is cancelled.
+        """
+        self._stopping.set()
+        self._admission_thread.join()
+
+        with self._lock:
+            while self._deferred:
+                self._deferred.popleft()[1].future.cancel()
+            stages = list(self._stages.values())
+        for q in stages:
+            q.close()
+        for q in stages:
+            for t in q.threads:
+                t.join()
+
+
+# ---------------- SHARED INSTANCE ----------------
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Process-wide scheduler, so interactive and bulk work competing in
+    one process (see service.py) go through the same stage queues.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = StageScheduler()
+    return _scheduler